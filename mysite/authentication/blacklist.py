@@ -0,0 +1,194 @@
+"""the refresh token blacklist, without a query per check
+
+Rotating refresh tokens blacklists the old one on every `token/refresh/`, so
+the blacklist only grows. Every process keeps the jtis of the blacklisted,
+unexpired tokens in a Bloom filter. A jti not in the filter was not
+blacklisted when it was last read, and the common refresh is answered
+without touching the tables. The few jtis the filter may hold are checked
+against the database as before.
+
+A thread of its own reads the rows added since its last read every
+`REFRESH_INTERVAL` seconds, and rebuilds the filter from scratch every
+`REBUILD_INTERVAL` seconds or when full, so no request waits for either. A
+Bloom filter cannot forget, so a rebuild is the only way pruned tokens leave
+it. A token blacklisted by another process since the last read still passes
+the filter. Rotation blacklists the presented token before issuing a new one,
+and that insert finds the existing row, so a rotated token is refused anyway.
+
+Expired tokens are of no use to anybody, `manage.py prunetokens` deletes them.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    :parms
+        capacity: items held before `error_rate` is exceeded (Int)
+        error_rate: share of absent items reported present (Float)
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def _positions(self, item):
+        # two halves of one digest, combined as in Kirsch and Mitzenmacher
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + index * second) % self.size for index in range(self.hashes))
+
+
+class BlacklistFilter(threading.Thread):
+    """the process' view of the blacklist, kept up to date by its own thread
+
+    requests only test the current filter, they never read the tables for it
+    nor wait for a rebuild. until the first build is done every jti is
+    checked against the database
+
+    :parms
+        capacity: blacklisted tokens held before a rebuild with twice the room (Int)
+        error_rate: share of tokens not blacklisted still checked against the database (Float)
+        refresh_interval: seconds between two reads of the newly blacklisted tokens (Float)
+        rebuild_interval: seconds between two full rebuilds (Float)
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.01, refresh_interval=5, rebuild_interval=60 * 60):
+        super().__init__(name='blacklist-filter', daemon=True)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._bloom = None
+        self._added = None  # jtis this process blacklisted while a rebuild runs
+        self._last_id = 0
+        self._rebuilt_at = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def might_contain(self, jti: str) -> bool:
+        """False when `jti` is certainly not blacklisted, as of the last read"""
+        bloom = self._bloom
+        return bloom is None or jti in bloom
+
+    def add(self, jti: str):
+        """note a token this process blacklisted, without waiting for the next read"""
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+            if self._added is not None:
+                self._added.append(jti)
+
+    def update(self):
+        """read the rows blacklisted since the last read, or rebuild when due"""
+        now = time.monotonic()
+        if self._rebuilt_at is None or now - self._rebuilt_at > self.rebuild_interval \
+                or self._bloom.count > self._bloom.capacity:
+            self._rebuild()
+            self._rebuilt_at = now
+        else:
+            rows = self._read(BlacklistedToken.objects.filter(pk__gt=self._last_id))
+            with self._lock:
+                for jti in rows:
+                    self._bloom.add(jti)
+
+    def _rebuild(self):
+        with self._lock:
+            self._added = []
+        try:
+            alive = BlacklistedToken.objects.filter(token__expires_at__gt=aware_utcnow())
+            bloom = BloomFilter(max(self.capacity, alive.count() * 2), self.error_rate)
+            self._last_id = 0
+            for jti in self._read(alive):
+                bloom.add(jti)
+            # the old filter answers the requests until the new one is complete
+            with self._lock:
+                for jti in self._added:
+                    bloom.add(jti)
+                self._bloom = bloom
+        finally:
+            with self._lock:
+                self._added = None
+
+    def _read(self, queryset):
+        jtis = []
+        for pk, jti in queryset.order_by('pk').values_list('pk', 'token__jti').iterator(chunk_size=5000):
+            jtis.append(jti)
+            self._last_id = pk
+        return jtis
+
+    def run(self):
+        while True:
+            try:
+                self.update()
+            except Exception:
+                logger.exception('Blacklist filter update failed')
+            finally:
+                close_old_connections()
+            if self._stopped.wait(self.refresh_interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_blacklist_filter() -> BlacklistFilter:
+    """the process' filter, its thread is started on first use"""
+    global _filter
+    if _filter is None:
+        with _filter_lock:
+            if _filter is None:
+                config = settings.TOKEN_BLACKLIST_FILTER
+                blacklist_filter = BlacklistFilter(
+                    config['CAPACITY'], config['ERROR_RATE'], config['REFRESH_INTERVAL'], config['REBUILD_INTERVAL']
+                )
+                blacklist_filter.start()
+                _filter = blacklist_filter
+    return _filter
+
+
+def prune_expired_tokens(now=None, batch_size=1000) -> int:
+    """delete the expired outstanding tokens and their blacklist rows, `batch_size` at a time
+
+    :returns
+        number of outstanding tokens deleted (Int)
+    """
+    now = now or aware_utcnow()
+    count = 0
+    while True:
+        # deleted rows drop out of the query, no cursor needed
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lte=now).order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return count
+        with transaction.atomic():
+            # the blacklist rows first, so the cascade finds nothing left to collect
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            count += OutstandingToken.objects.filter(pk__in=ids).delete()[1].get(OutstandingToken._meta.label, 0)
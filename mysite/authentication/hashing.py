@@ -0,0 +1,157 @@
+"""password hashing on a bounded pool of its own
+
+Hashing a password is slow on purpose. When a class starts and everybody
+logs in at once, the request threads would all be hashing, and the game's
+API calls would wait behind them. Signup and login hash on the process'
+`HashingPool` instead. It holds `WORKERS` threads and at most `MAX_QUEUE`
+hashes waiting for one. Anything more is refused at once, so at most
+`WORKERS + MAX_QUEUE` request threads are ever held by authentication. The
+api answers a refusal with a 429, other logins (the admin's) simply fail.
+hashlib releases the GIL while it hashes, so the workers do run in parallel.
+"""
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model, hashers
+from django.contrib.auth.backends import ModelBackend
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
+
+from mysite.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+hashing_seconds = Histogram(
+    'auth_password_hashing_seconds', 'Password hashing time per operation.', ['operation'])
+hashing_wait_seconds = Histogram(
+    'auth_password_hashing_wait_seconds', 'Time a password hash waited for a hashing thread.')
+hashing_pending = Gauge(
+    'auth_password_hashing_pending', 'Password hashes running or waiting for a hashing thread.')
+hashing_rejected = Counter(
+    'auth_password_hashing_rejected', 'Hashes refused as the hashing pool was full.', ['operation'])
+
+
+class PoolFull(Exception):
+    """the hashing pool and its queue are full, `retry_after` seconds is the expected wait"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+    def throttled(self) -> Throttled:
+        """the 429 the api answers with"""
+        return Throttled(wait=self.retry_after)
+
+
+class HashingPool:
+    """
+    :parms
+        workers: threads hashing at once (Int)
+        max_queue: hashes waiting for a thread before new ones are refused (Int)
+    """
+
+    def __init__(self, workers=2, max_queue=8):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+        self._pending = 0
+        self._mean_seconds = 0.25  # moving average of one hash, for `Retry-After`
+        self._lock = threading.Lock()
+
+    def run(self, operation: str, function, *args):
+        """`function(*args)` on a hashing thread, the caller waits for its result
+
+        :parms
+            operation: metrics label (Str)
+
+        :raises
+            PoolFull: the pool and its queue are full
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                hashing_rejected.labels(operation).inc()
+                raise PoolFull(math.ceil(self._mean_seconds * self._pending / self.workers))
+            self._pending += 1
+        hashing_pending.inc()
+        try:
+            return self._executor.submit(self._timed, operation, function, args, time.monotonic()).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            hashing_pending.dec()
+
+    def _timed(self, operation, function, args, submitted_at):
+        started = time.monotonic()
+        hashing_wait_seconds.observe(started - submitted_at)
+        try:
+            return function(*args)
+        finally:
+            seconds = time.monotonic() - started
+            hashing_seconds.labels(operation).observe(seconds)
+            self._mean_seconds = self._mean_seconds * 0.9 + seconds * 0.1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool() -> HashingPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = settings.PASSWORD_HASHING_POOL
+                _pool = HashingPool(config['WORKERS'], config['MAX_QUEUE'])
+    return _pool
+
+
+def make_password(password: str) -> str:
+    """`django.contrib.auth.hashers.make_password` on the hashing pool"""
+    return get_hashing_pool().run('make', hashers.make_password, password)
+
+
+class PooledModelBackend(ModelBackend):
+    """`ModelBackend` checking passwords on the hashing pool
+
+    only the hashing leaves the request thread, the user is read and an
+    outdated hash is saved on the request thread and its connection
+
+    a full pool is a 429 for api requests, anywhere else, e.g. the admin's
+    login, nothing handles `Throttled` and the login just fails
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        try:
+            return self._authenticate(request, username, password, **kwargs)
+        except PoolFull as e:
+            if isinstance(request, Request):
+                raise e.throttled()
+            logger.warning('Login of %s refused, the password hashing pool is full', username)
+            return None
+
+    def _authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # hash anyway, the response time must not tell which usernames exist
+            make_password(password)
+            return None
+
+        outdated = []
+        valid = get_hashing_pool().run('check', hashers.check_password, password, user.password, outdated.append)
+        if not valid or not self.user_can_authenticate(user):
+            return None
+        if outdated:
+            # the hasher settings changed since the password was set
+            user.password = make_password(password)
+            user.save(update_fields=['password'])
+        return user
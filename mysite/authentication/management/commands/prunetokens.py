@@ -0,0 +1,25 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from authentication.blacklist import prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Delete expired refresh tokens and their blacklist rows in batches, see `authentication.blacklist`.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tokens deleted per transaction.')
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep pruning every this many seconds, 0 prunes once.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.stdout.write(f'pruned={prune_expired_tokens(batch_size=options["batch_size"])}')
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -1,13 +1,24 @@
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
 from rest_framework import serializers
+from .hashing import PoolFull, make_password
 from .models import CustomUser
+from .tokens import RefreshToken
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = RefreshToken
 
     @classmethod
     def get_token(cls, user: CustomUser):
-        token = super(MyTokenObtainPairSerializer, cls).get_token(user)
+        # not `super().get_token`, simplejwt before 5.2 ignores `token_class`
+        token = RefreshToken.for_user(user)
 
         # Add custom claims
         token['username'] = user.username
@@ -33,6 +44,52 @@ class CustomUserSerializer(serializers.ModelSerializer):
         password = validated_data.pop('password', None)
         instance = self.Meta.model(**validated_data)  # as long as the fields are the same, we can just use this
         if password is not None:
-            instance.set_password(password)
+            try:
+                instance.password = make_password(password)
+            except PoolFull as e:
+                raise e.throttled()
         instance.save()
         return instance
+
+
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    """`TokenRefreshSerializer` refusing a refresh token used twice, whatever the process' filter knows"""
+    token_class = RefreshToken
+    default_error_messages = {
+        'no_active_account': _('No active account found with the given credentials'),
+    }
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+
+        user = None
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM, None)
+        if user_id:
+            user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+            if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+                raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                # the insert is the exact check, another process may have rotated the token meanwhile
+                created = refresh.blacklist()[1]
+                if not created:
+                    raise TokenError(_('Token is blacklisted'))
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            # `refresh.outstand()` is simplejwt 5.3 and later
+            OutstandingToken.objects.create(
+                user=user,
+                jti=refresh[api_settings.JTI_CLAIM],
+                token=str(refresh),
+                created_at=refresh.current_time,
+                expires_at=datetime_from_epoch(refresh['exp']),
+            )
+
+            data['refresh'] = str(refresh)
+
+        return data
@@ -66,7 +66,9 @@ class Game extends Component {
             });
 
         const token = localStorage.getItem('access_token');
-        let ws = new WebSocket(wsProtocol + wsBaseURL + '/ws/game/' + roomName + '/?token=' + token);
+        // after a reconnect the server only sends the updates missed since this version
+        const resume = this.roomVersion === undefined ? '' : '&resume=' + this.roomVersion;
+        let ws = new WebSocket(wsProtocol + wsBaseURL + '/ws/game/' + roomName + '/?token=' + token + resume);
         let that = this;
         let connectInterval;
 
@@ -87,6 +89,9 @@ class Game extends Component {
             const username = getUserName();
             switch (message.event) {
                 case 'room_data_updated':
+                    if (message.version !== null && message.version !== undefined) {
+                        this.roomVersion = message.version;
+                    }
                     this.setState({ roomData: message.room_data });
                     // this.setState({badgeMessage: {}});
                     break;
@@ -98,6 +103,9 @@ class Game extends Component {
                 case 'new_room_received':
                     window.location.href = `/games/${message.room_id}/`;
                     break;
+                case 'rate_limited':
+                    console.warn(`${message.event_type} ignored, retry in ${message.retry_after}s`);
+                    break;
                 default:
                     console.error('This event did not handled', message);
                     break;
@@ -1,5 +1,5 @@
 import React, { Component } from 'react';
-import { Badge } from 'react-bootstrap';
+import { Badge, Button } from 'react-bootstrap';
 import { Helmet } from 'react-helmet';
 import axiosInstance from '../api/Api';
 import getUserName from '../utils/getUserName';
@@ -12,6 +12,8 @@ class GameHistory extends Component {
 
         this.state = {
             roomList: [],
+            nextPage: null,
+            summary: null,
             loaded: false,
         };
     }
@@ -20,14 +22,36 @@ class GameHistory extends Component {
         axiosInstance
             .get('game/history/')
             .then((response) => {
-                let roomList = response.data;
-                this.setState({ roomList: roomList, loaded: true });
+                let roomList = response.data.results;
+                this.setState({ roomList: roomList, nextPage: response.data.next, loaded: true });
+            })
+            .catch((err) => {
+                console.error(err);
+            });
+        axiosInstance
+            .get('game/summary/')
+            .then((response) => {
+                this.setState({ summary: response.data });
             })
             .catch((err) => {
                 console.error(err);
             });
     }
 
+    loadMoreClicked = () => {
+        axiosInstance
+            .get(this.state.nextPage)
+            .then((response) => {
+                this.setState({
+                    roomList: this.state.roomList.concat(response.data.results),
+                    nextPage: response.data.next,
+                });
+            })
+            .catch((err) => {
+                console.error(err);
+            });
+    };
+
     render() {
         const username = getUserName();
         let roomPlayingHistory = [];
@@ -66,6 +90,11 @@ class GameHistory extends Component {
                         </h5>
                     ) : null}
                     {roomEndHistory}
+                    {this.state.nextPage ? (
+                        <Button variant={'outline-brown'} className={'my-3'} block={true} onClick={this.loadMoreClicked}>
+                            載入更多紀錄
+                        </Button>
+                    ) : null}
                 </>
             );
         } else {
@@ -78,6 +107,12 @@ class GameHistory extends Component {
                     <title>{`${username} 的遊玩紀錄`}</title>
                 </Helmet>
                 <h5 className={'text-center pt-3'}>{username} 的遊玩紀錄</h5>
+                {this.state.summary ? (
+                    <div className={'text-muted small text-center'}>
+                        已完成 {this.state.summary.games_played} 場遊戲，獲勝 {this.state.summary.wins} 場，共獲得{' '}
+                        {this.state.summary.points} 塊金塊
+                    </div>
+                ) : null}
                 {this.state.loaded ? historyDiv : <Loading />}
             </>
         );
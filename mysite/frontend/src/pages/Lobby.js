@@ -24,6 +24,7 @@ class Lobby extends Component {
         this.state = {
             ws: null,
             roomList: [],
+            nextPage: null,
             socketErrorMessage: null,
             loaded: false,
         };
@@ -35,7 +36,7 @@ class Lobby extends Component {
         axiosInstance
             .get('game/room_list/')
             .then((response) => {
-                this.setState({ roomList: response.data, loaded: true });
+                this.setState({ roomList: response.data.results, nextPage: response.data.next, loaded: true });
 
                 // TODO: Websocket connect to fetch new room status
                 this.connectSocket();
@@ -45,6 +46,20 @@ class Lobby extends Component {
             });
     }
 
+    loadMoreClicked = () => {
+        axiosInstance
+            .get(this.state.nextPage)
+            .then((response) => {
+                // rooms pushed by websocket may already be in the list
+                const known = new Set(this.state.roomList.map((room) => room.permanent_url));
+                const newRooms = response.data.results.filter((room) => !known.has(room.permanent_url));
+                this.setState({ roomList: this.state.roomList.concat(newRooms), nextPage: response.data.next });
+            })
+            .catch((err) => {
+                console.error(err);
+            });
+    };
+
     connectSocket() {
         // TODO: socket connect
         // check token valid first
@@ -174,6 +189,11 @@ class Lobby extends Component {
                 ) : (
                     <Loading />
                 )}
+                {this.state.nextPage ? (
+                    <Button variant={'outline-brown'} className={'my-3'} block={true} onClick={this.loadMoreClicked}>
+                        載入更多房間
+                    </Button>
+                ) : null}
             </>
         );
     }
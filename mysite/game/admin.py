@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import GameRoom, PlayerData
+from .models import GameArchive, GameRoom, PlayerData, PlayerSummary
 
 admin.site.register(GameRoom)
 admin.site.register(PlayerData)
+admin.site.register(PlayerSummary)
+admin.site.register(GameArchive)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class GameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'game'
+
+    def ready(self):
+        if settings.TRACING['ENABLED']:
+            # let the engine report its phases into the traces
+            from mysite.tracing import span
+            from saboteur import tracing as engine_tracing
+            engine_tracing.set_tracer(span)
@@ -1,18 +1,122 @@
 import json
+from urllib.parse import parse_qs
+
 from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from channels.consumer import SyncConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer, WebsocketConsumer
 from channels.exceptions import DenyConnection
 
+from authentication.models import CustomUser
+from mysite import tracing
+from . import metrics
+from .frames import EncodedFramesMixin, negotiate
+from .matchmaking import VOLUMES, Ticket, get_matchmaker
 from .serializers import GameRoomSerializer, LightGameRoomSerializer
-from .models import GameRoom
+from .models import GameRoom, PlayerData, StaleRoomError
+from .ratelimit import RateLimiter
+from .resume import get_resume_buffer
+from .spectators import get_spectator_hub
+from .sweeper import get_room_presence
+from .sharding import MAX_HOPS, get_shard_router, shard_channel, worker_id_from_channel
+from .turn_timers import ensure_turn, fold_turn
+
+
+def handle_room_event(room: GameRoom, user: CustomUser, text_data_json: dict, channel_layer, reply):
+    """apply one event sent by a player of `room`
+
+    :parms
+        room: the room the event is sent to (GameRoom)
+        user: the sender, only `pk` and `username` are used (CustomUser)
+        text_data_json: the decoded websocket frame (Dict)
+        channel_layer: layer used for group broadcasts
+        reply: callable delivering an `alert_message` event to the sender only
+    """
+    try:
+        with metrics.count_queries(metrics.event_label(text_data_json)):
+            _handle_room_event(room, user, text_data_json, channel_layer, reply)
+    except StaleRoomError:
+        reply({'type': 'alert_message', 'message': {'msg_type': 'ILLEGAL_PLAY', 'msg': '遊戲狀態已更新，請再試一次'}})
+    except GameRoom.DoesNotExist:
+        # deleted while the event was applied, by the sweeper, an admin or its last player leaving
+        reply({'type': 'alert_message', 'message': {'msg_type': 'ILLEGAL_PLAY', 'msg': '房間已不存在'}})
+
+
+def _handle_room_event(room, user, text_data_json, channel_layer, reply):
+    event = text_data_json['event']
+    room_group_name = room.room_group_name()
+
+    if event == 'status_change':
+        if room.admin_id == user.pk:
+            room.change_status(text_data_json['message'])
+
+    elif event == 'volume_change':
+        volume = int(text_data_json['volume'])
+
+        def change_volume(room):
+            # the same volume again would only cost a save and two broadcasts
+            if room.admin_id != user.pk or room.volume == volume:
+                return False
+            room.volume = volume
+
+        room.save_with_retry(change_volume)
+
+    elif event == 'kick_player':
+        if room.admin_id == user.pk:
+            room.kick_player(text_data_json['username'])
+            metrics.group_send(
+                channel_layer, room_group_name,
+                {
+                    'type': 'player_kicked',
+                    'username': text_data_json['username']
+                }
+            )
+
+    elif event == 'play_card':
+        with tracing.span('room_fetch'):
+            now_play = room.get_game_data()['now_play']
+        if now_play == user.username:
+            return_msg = room.state_control(
+                int(text_data_json['id']),
+                int(text_data_json['pos']),
+                int(text_data_json['rotate']),
+                int(text_data_json['act']),
+                player=user.username
+            )
+
+            if return_msg is not None:
+                event = {'type': 'alert_message', 'message': return_msg}
+                if return_msg['msg_type'] == 'INFO':
+                    # Send message to room group
+                    metrics.group_send(
+                        channel_layer, room_group_name, event
+                    )
+                else:
+                    reply(event)
+
+    elif event == 'create_new_room':
+        if room.admin_id == user.pk:
+            new_room = GameRoom.objects.create(volume=room.volume, admin_id=room.admin_id)
+            metrics.group_send(
+                channel_layer, room_group_name,
+                {
+                    'type': 'send_new_room',
+                    'room_id': new_room.permanent_url
+                }
+            )
 
 
-class GameRoomConsumer(WebsocketConsumer):
+class GameRoomConsumer(EncodedFramesMixin, WebsocketConsumer):
     def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room: GameRoom = self._get_room()
         self.room_group_name = self.room.room_group_name()
         self.can_speak = False
+        user = self.scope['user']
+        self.rate_limiter = RateLimiter(user.pk if user.is_authenticated else None)
+        # the latest volume_change not applied yet
+        self.pending_volume_change = None
+        # the newest update version sent, older updates still queued are skipped
+        self.sent_version = 0
 
         # Join room group
         async_to_sync(self.channel_layer.group_add)(
@@ -20,11 +124,33 @@ class GameRoomConsumer(WebsocketConsumer):
             self.channel_name
         )
 
-        self.accept()
+        self.accept_encoded()
+        metrics.websocket_connections.labels('game').inc()
+        # keeps an idle lobby from being swept while this socket waits in it
+        get_room_presence().connected(self.room.pk)
+        if self.room.status == GameRoom.StatusType.PLAYING:
+            # the deadline may have been lost with the process that set it
+            ensure_turn(self.room)
+
+        resume_version = self._get_resume_version()
+        if resume_version is not None and self._is_player():
+            # a reconnect, neither the database nor the other players hear of it
+            self.can_speak = True
+            self._resume(resume_version)
+            return
+
         # set user can send message or not
-        self.can_speak = self.room.join_room(self.scope['user'])
+        self.can_speak, joined = self.room.join_room(self.scope['user'])
+        if not joined:
+            # nobody else has to know, only this socket needs the room state
+            self.update_room(None)
 
     def disconnect(self, close_code):
+        if not hasattr(self, 'room_group_name'):
+            # the connection was denied before it was accepted
+            return
+        metrics.websocket_connections.labels('game').dec()
+        get_room_presence().disconnected(self.room.pk)
         # leave room
         self.room.leave_room(self.scope['user'])
         # Leave room group
@@ -34,99 +160,156 @@ class GameRoomConsumer(WebsocketConsumer):
         )
 
     # Receive message from WebSocket (frontend)
-    def receive(self, text_data):
+    def receive(self, text_data=None, bytes_data=None):
         if self.can_speak:
-            text_data_json = json.loads(text_data)
-            event = text_data_json['event']
-
-            if event == 'status_change':
-                if self.room.admin == self.scope['user']:
-                    self.room.change_status(text_data_json['message'])
-
-            elif event == 'volume_change':
-                if self.room.admin == self.scope['user']:
-                    self.room.volume = int(text_data_json['volume'])
-                    self.room.save()
-
-            elif event == 'kick_player':
-                if self.room.admin == self.scope['user']:
-                    self.room.kick_player(text_data_json['username'])
-                    async_to_sync(self.channel_layer.group_send)(
-                        self.room_group_name,
-                        {
-                            'type': 'player_kicked',
-                            'username': text_data_json['username']
-                        }
-                    )
+            text_data_json = self.decode_event(text_data, bytes_data)
+            event = metrics.event_label(text_data_json)
+            if event == 'volume_change':
+                # a burst is applied once, with its latest value, by `apply_volume_change`
+                if self.pending_volume_change is None:
+                    async_to_sync(self.channel_layer.send)(self.channel_name, {'type': 'apply_volume_change'})
+                else:
+                    metrics.coalesced_events.labels(event).inc()
+                self.pending_volume_change = text_data_json
+                return
+            self._handle(text_data_json, event, text_data)
 
-            elif event == 'play_card':
-                if self.room.game_data['now_play'] == self.scope['user'].username:
-                    return_msg = self.room.state_control(
-                        int(text_data_json['id']),
-                        int(text_data_json['pos']),
-                        int(text_data_json['rotate']),
-                        int(text_data_json['act'])
-                    )
+    def apply_volume_change(self, message):
+        text_data_json, self.pending_volume_change = self.pending_volume_change, None
+        if text_data_json is not None and self.can_speak:
+            self._handle(text_data_json, 'volume_change')
 
-                    if return_msg is not None:
-                        event = {'type': 'alert_message', 'message': return_msg}
-                        if return_msg['msg_type'] == 'INFO':
-                            # Send message to room group
-                            async_to_sync(self.channel_layer.group_send)(
-                                self.room_group_name, event
-                            )
-                        else:
-                            self.alert_message(event)
-
-            elif event == 'create_new_room':
-                if self.room.admin == self.scope['user']:
-                    new_room = GameRoom.objects.create(volume=self.room.volume, admin=self.room.admin)
-                    new_room.save()
-                    async_to_sync(self.channel_layer.group_send)(
-                        self.room_group_name,
-                        {
-                            'type': 'send_new_room',
-                            'room_id': new_room.permanent_url
-                        }
-                    )
+    def _handle(self, text_data_json, event, text_data=None):
+        retry_after = self.rate_limiter.check(event)
+        if retry_after:
+            self._rate_limited(event, retry_after)
+            return
+        if text_data is None:
+            # shard workers are always forwarded json
+            text_data = json.dumps(text_data_json)
+        with metrics.event_seconds.labels(event).time(), tracing.trace('receive', event=event):
+            self._receive(text_data, text_data_json)
+
+    def _rate_limited(self, event, retry_after):
+        metrics.rate_limited_events.labels(event).inc()
+        if self.rate_limiter.abusive():
+            metrics.rate_limited_closes.inc()
+            self.can_speak = False
+            self.close(code=4029)
+            return
+        self.send_event({
+            'event': 'rate_limited',
+            'event_type': event,
+            'retry_after': round(retry_after, 3),
+        })
+
+    def _receive(self, text_data, text_data_json):
+        router = get_shard_router()
+        owner = None if router is None else router.owner(self.room_name)
+
+        if owner is None:
+            # room updates do not reload the room, the event is applied to its current row
+            with tracing.span('room_fetch'):
+                room = GameRoom.objects.defer('game_data').filter(permanent_url=self.room_name).first()
+            if room is None:
+                return
+            self.room = room
+            handle_room_event(self.room, self.scope['user'], text_data_json,
+                              self.channel_layer, self.alert_message)
+        else:
+            # the room belongs to a shard worker, it is the only one writing it
+            async_to_sync(self.channel_layer.send)(shard_channel(owner), {
+                'type': 'room_event',
+                'room_name': self.room_name,
+                'user_id': self.scope['user'].pk,
+                'username': self.scope['user'].username,
+                'reply_channel': self.channel_name,
+                'text_data': text_data,
+                'hops': 0,
+            })
 
     def alert_message(self, event):
         return_msg = event['message']
 
-        self.send(text_data=json.dumps({
+        self.send_event({
             'event': 'alert_message',
             'message': return_msg
-        }))
+        })
 
     def _get_room(self) -> GameRoom:
-        game_room = GameRoom.objects.get(permanent_url=self.room_name)
+        game_room = GameRoom.objects.filter(permanent_url=self.room_name).first()
 
         if game_room is None:
             raise DenyConnection('Game not exist.')
 
         return game_room
 
+    def _get_resume_version(self):
+        """the `resume` query parameter, the last version seen before reconnecting"""
+        try:
+            return int(parse_qs(self.scope['query_string'].decode('utf8'))['resume'][0])
+        except (KeyError, ValueError):
+            return None
+
+    def _is_player(self):
+        user = self.scope['user']
+        return user.is_authenticated and PlayerData.objects.filter(room=self.room, player=user).exists()
+
+    def _resume(self, version):
+        latest, updates = get_resume_buffer().since(self.room_name, version)
+        if updates is None:
+            # the missed updates were dropped already
+            self.update_room(None)
+            return
+        for version, room_data in updates:
+            self.send_event({
+                'event': 'room_data_updated',
+                'room_data': room_data,
+                'version': version,
+            })
+            self.sent_version = version
+
     def update_room(self, event):
-        self.room = self._get_room()
-        self.send(text_data=json.dumps({
-            'event': 'room_data_updated',
-            'room_data': GameRoomSerializer(self.room).data
-        }))
+        if event is not None and (event.get('version') or 0) <= self.sent_version:
+            if get_resume_buffer().version(self.room_name) >= self.sent_version:
+                # queued while this socket lagged behind, its state was sent already
+                metrics.coalesced_events.labels('update_room').inc()
+                return
+            # the buffer lost the room and its versions restarted, start over from a snapshot
+            event = None
+        with tracing.trace('update_room'):
+            if event is not None and event.get('room_data') is not None:
+                # serialized once by the sender for the whole group
+                version, room_data = event['version'], event['room_data']
+            else:
+                # the version is read first, the state sent is at least as new
+                version = get_resume_buffer().version(self.room_name)
+                with tracing.span('room_fetch'):
+                    self.room = self._get_room()
+                with tracing.span('serialize'):
+                    room_data = GameRoomSerializer(self.room).data
+            with tracing.span('send'):
+                self.send_event({
+                    'event': 'room_data_updated',
+                    'room_data': room_data,
+                    'version': version,
+                })
+            self.sent_version = version or 0
 
     def player_kicked(self, event):
-        self.send(text_data=json.dumps({
+        self.send_event({
             'event': 'room_player_kicked',
             'username': event['username']
-        }))
+        })
 
     def send_new_room(self, event):
-        self.send(text_data=json.dumps({
+        self.send_event({
             'event': 'new_room_received',
             'room_id': event['room_id']
-        }))
+        })
 
 
-class LobbyConsumer(WebsocketConsumer):
+class LobbyConsumer(EncodedFramesMixin, WebsocketConsumer):
     def connect(self):
         # Join group
         async_to_sync(self.channel_layer.group_add)(
@@ -134,9 +317,11 @@ class LobbyConsumer(WebsocketConsumer):
             self.channel_name
         )
 
-        self.accept()
+        self.accept_encoded()
+        metrics.websocket_connections.labels('lobby').inc()
 
     def disconnect(self, close_code):
+        metrics.websocket_connections.labels('lobby').dec()
         # Leave group
         async_to_sync(self.channel_layer.group_discard)(
             GameRoom.lobby_socket_group_name,
@@ -144,16 +329,116 @@ class LobbyConsumer(WebsocketConsumer):
         )
 
     def delete_room(self, event):
-        self.send(text_data=json.dumps({
+        self.send_event({
             'event': 'room_data_deleted',
             'room_name': event['room_name']
-        }))
+        })
 
     def update_room(self, event):
-        room = GameRoom.objects.get(permanent_url=event['room_name'])
+        room = GameRoom.objects.light().filter(permanent_url=event['room_name']).first()
         if room is not None:
-            self.send(text_data=json.dumps({
+            self.send_event({
                 'event': 'room_data_updated',
                 'room_name': event['room_name'],
                 'room_data': LightGameRoomSerializer(room).data
-            }))
+            })
+
+
+class MatchmakingConsumer(EncodedFramesMixin, WebsocketConsumer):
+    """waits in the matchmaking queue of `?volume=` (default 4) until a room is found
+
+    the socket is closed after the `match_found` event, see `game.matchmaking`
+    """
+    def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            raise DenyConnection('Login required.')
+        try:
+            self.volume = int(parse_qs(self.scope['query_string'].decode('utf8')).get('volume', ['4'])[0])
+        except ValueError:
+            self.volume = None
+        if self.volume not in VOLUMES:
+            raise DenyConnection('Invalid volume.')
+
+        self.accept_encoded()
+        metrics.websocket_connections.labels('matchmaking').inc()
+        position = get_matchmaker().enqueue(Ticket(user.pk, self.channel_name), self.volume)
+        self.send_event({'event': 'queued', 'volume': self.volume, 'waiting': position})
+
+    def disconnect(self, close_code):
+        if getattr(self, 'volume', None) not in VOLUMES:
+            # the connection was denied before it was accepted
+            return
+        metrics.websocket_connections.labels('matchmaking').dec()
+        get_matchmaker().cancel(self.scope['user'].pk, self.channel_name)
+
+    def match_found(self, event):
+        self.send_event({'event': 'match_found', 'room_name': event['room_name']})
+        self.close()
+
+
+class SpectatorConsumer(AsyncWebsocketConsumer):
+    """watches a room, receives its public projection only and can not send events
+
+    an async consumer, spectators are fed from the per-process hub of `game.spectators`
+    without a thread or a database query of their own
+    """
+    room_name = None
+
+    async def connect(self):
+        if not self.scope['user'].is_authenticated:
+            raise DenyConnection('Login required.')
+        self.encoding, subprotocol = negotiate(self.scope)
+        await self.accept(subprotocol)
+        metrics.websocket_connections.labels('spectator').inc()
+        self.room_name = self.scope['url_route']['kwargs']['room_name']
+        await get_spectator_hub().watch(self.room_name, self)
+
+    async def disconnect(self, close_code):
+        if self.room_name is None:
+            # the connection was denied before it was accepted
+            return
+        metrics.websocket_connections.labels('spectator').dec()
+        await get_spectator_hub().unwatch(self.room_name, self)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        pass
+
+
+class GameShardConsumer(SyncConsumer):
+    """
+    Runs inside `manage.py runshard`, applies the room events forwarded to this worker
+    """
+
+    def room_event(self, message):
+        if self._forwarded(message):
+            return
+
+        text_data_json = json.loads(message['text_data'])
+        with tracing.trace('room_event', event=metrics.event_label(text_data_json)):
+            with tracing.span('room_fetch'):
+                room = GameRoom.objects.filter(permanent_url=message['room_name']).first()
+            if room is None:
+                return
+
+            def reply(event):
+                async_to_sync(self.channel_layer.send)(message['reply_channel'], event)
+
+            user = CustomUser(pk=message['user_id'], username=message['username'])
+            handle_room_event(room, user, text_data_json, self.channel_layer, reply)
+
+    def expire_turn(self, message):
+        """a turn deadline passed in a process not owning the room"""
+        if self._forwarded(message):
+            return
+        fold_turn(message['room_name'], tuple(message['turn']))
+
+    def _forwarded(self, message):
+        """pass `message` on when the ring moved since the sender looked it up"""
+        worker_id = worker_id_from_channel(self.scope['channel'])
+        owner = get_shard_router().owner(message['room_name'])
+
+        if owner is not None and owner != worker_id and message['hops'] < MAX_HOPS:
+            async_to_sync(self.channel_layer.send)(shard_channel(owner), {**message, 'hops': message['hops'] + 1})
+            return True
+        return False
@@ -0,0 +1,84 @@
+"""bulk export of a user's finished games
+
+Rows are read with one ordered query through a server-side cursor
+(`QuerySet.iterator`) and written out as they arrive, `game_data` is never
+read. Every exported game holds:
+
+    room        permanent_url
+    date        when the room was created, ISO 8601
+    players     usernames of everyone in the game
+    points      the user's points
+    outcome     `win` when nobody scored more than the user, else `loss`
+"""
+import csv
+import json
+from itertools import groupby
+
+from .models import GameRoom, PlayerData
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+OUTPUTS = {
+    NDJSON: 'application/x-ndjson',
+    CSV: 'text/csv',
+}
+FIELDS = ['room', 'date', 'players', 'points', 'outcome']
+CHUNK_SIZE = 500
+
+
+def history_rows(user, since=None, until=None):
+    """yield a dict of `FIELDS` per finished game of `user`, oldest first
+
+    :parms
+        since: only games created at or after it (Datetime)
+        until: only games created before it (Datetime)
+    """
+    rooms = GameRoom.objects.filter(status=GameRoom.StatusType.END, playerdata__player=user)
+    if since is not None:
+        rooms = rooms.filter(created_at__gte=since)
+    if until is not None:
+        rooms = rooms.filter(created_at__lt=until)
+
+    # every player of a room is read in a row, so the rooms can be assembled one by one
+    players_data = PlayerData.objects.filter(room__in=rooms.values('pk')) \
+        .order_by('room__created_at', 'room_id', 'pk') \
+        .values_list('room_id', 'room__permanent_url', 'room__created_at', 'player_id', 'player__username', 'point') \
+        .iterator(chunk_size=CHUNK_SIZE)
+
+    for _, rows in groupby(players_data, key=lambda row: row[0]):
+        rows = list(rows)
+        _, permanent_url, created_at = rows[0][:3]
+        best = max(row[5] for row in rows)
+        points = next(row[5] for row in rows if row[3] == user.pk)
+        yield {
+            'room': permanent_url,
+            'date': created_at.isoformat(),
+            'players': [row[4] for row in rows],
+            'points': points,
+            'outcome': 'win' if best > 0 and points == best else 'loss',
+        }
+
+
+class _Echo:
+    """file-like object whose `write` hands the line back to `csv.writer`"""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow([
+            row['room'], row['date'], ';'.join(row['players']), row['points'], row['outcome'],
+        ])
+
+
+def export_lines(rows, output):
+    return csv_lines(rows) if output == CSV else ndjson_lines(rows)
@@ -0,0 +1,86 @@
+"""websocket frame encodings negotiated per connection
+
+Clients keep getting JSON text frames unless they ask for a binary encoding,
+either with a websocket subprotocol or with the `encoding` query parameter:
+
+    json                 text frames, the default
+    msgpack              binary frames holding one MessagePack map
+    msgpack.deflate      binary frames starting with one header byte,
+                         0: MessagePack follows, 1: zlib compressed MessagePack follows
+
+The subprotocols are the same names prefixed with `saboteur.`. Frames a
+client sends are decoded the same way, text frames are always JSON.
+"""
+import json
+import zlib
+from urllib.parse import parse_qs
+
+import msgpack
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+MSGPACK_DEFLATE = 'msgpack.deflate'
+ENCODINGS = (JSON, MSGPACK, MSGPACK_DEFLATE)
+SUBPROTOCOL_PREFIX = 'saboteur.'
+
+# smaller frames are sent uncompressed, zlib would not pay for its header
+COMPRESS_MIN_SIZE = 512
+RAW, DEFLATED = b'\x00', b'\x01'
+
+
+def negotiate(scope):
+    """pick the encoding of a websocket connection
+
+    :returns
+        encoding: one of `ENCODINGS` (Str)
+        subprotocol: the subprotocol to accept the connection with (Str or None)
+    """
+    for subprotocol in scope.get('subprotocols') or ():
+        encoding = subprotocol[len(SUBPROTOCOL_PREFIX):]
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX) and encoding in ENCODINGS:
+            return encoding, subprotocol
+
+    encoding = parse_qs(scope.get('query_string', b'').decode('utf8')).get('encoding', [JSON])[0]
+    return (encoding if encoding in ENCODINGS else JSON), None
+
+
+def encode(data: dict, encoding: str):
+    """
+    :returns
+        text_data, bytes_data: the frame, exactly one of them is not None
+    """
+    if encoding == JSON:
+        return json.dumps(data), None
+
+    packed = msgpack.packb(data, use_bin_type=True)
+    if encoding == MSGPACK:
+        return None, packed
+    if len(packed) < COMPRESS_MIN_SIZE:
+        return None, RAW + packed
+    return None, DEFLATED + zlib.compress(packed, 6)
+
+
+def decode(text_data, bytes_data, encoding: str) -> dict:
+    if text_data is not None:
+        return json.loads(text_data)
+    if encoding == MSGPACK_DEFLATE:
+        header, bytes_data = bytes_data[:1], bytes_data[1:]
+        if header == DEFLATED:
+            bytes_data = zlib.decompress(bytes_data)
+    return msgpack.unpackb(bytes_data, raw=False)
+
+
+class EncodedFramesMixin:
+    """for `WebsocketConsumer`s, sends and receives frames in the negotiated encoding"""
+    encoding = JSON
+
+    def accept_encoded(self):
+        self.encoding, subprotocol = negotiate(self.scope)
+        self.accept(subprotocol)
+
+    def send_event(self, data: dict):
+        text_data, bytes_data = encode(data, self.encoding)
+        self.send(text_data=text_data, bytes_data=bytes_data)
+
+    def decode_event(self, text_data, bytes_data) -> dict:
+        return decode(text_data, bytes_data, self.encoding)
@@ -0,0 +1,244 @@
+"""player standings, updated once per finished game
+
+Two boards are kept, both sorted by points:
+
+    all        points of every game ever finished
+    recent     points of the games finished during the last `window_days` days
+
+The recent board is the sum of one bucket per day. It is built from the
+buckets when first read on a day and then kept up to date by every recorded
+game, so neither board is ever computed from `PlayerData`. Rebuild both
+from the database with `manage.py rebuildleaderboard`.
+
+The top of a board is cached per process for `cache_ttl` seconds, a player's
+rank is read from the sorted board on every request.
+"""
+import bisect
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+ALL = 'all'
+RECENT = 'recent'
+BOARDS = (ALL, RECENT)
+
+
+class BaseLeaderboard:
+    """
+    :parms
+        window_days: days summed up by the recent board (Int)
+        top_size: entries of a board's top kept in the cache, the most `top` returns (Int)
+        cache_ttl: seconds a cached top is served (Float)
+    """
+
+    def __init__(self, window_days=7, top_size=100, cache_ttl=10):
+        self.window_days = window_days
+        self.top_size = top_size
+        self.cache_ttl = cache_ttl
+        self._top_cache = {}
+
+    def record(self, points: dict, day=None):
+        """add the points of one finished game
+
+        :parms
+            points: username to points (Dict)
+            day: the game's day, defaults to today (Date)
+        """
+        self._record(points, day or timezone.localdate())
+        self._top_cache.clear()
+
+    def top(self, board: str, limit: int) -> list:
+        """the `limit` best `(username, points)` of `board`, at most `top_size`"""
+        expires_at, entries = self._top_cache.get(board, (0, None))
+        if expires_at < time.monotonic():
+            entries = self._top(board, timezone.localdate())
+            self._top_cache[board] = (time.monotonic() + self.cache_ttl, entries)
+        return entries[:limit]
+
+    def rank(self, board: str, username: str):
+        """the `(rank, points)` of `username` on `board` counting from 1, None if not ranked"""
+        return self._rank(board, username, timezone.localdate())
+
+    def replace(self, all_points: dict, day_points: dict):
+        """replace every standing, used to rebuild the boards from the database
+
+        :parms
+            all_points: username to all-time points (Dict)
+            day_points: day to a dict of username to points, days out of the window are ignored (Dict)
+        """
+        today = timezone.localdate()
+        self._replace(all_points, {day: points for day, points in day_points.items()
+                                   if day in self._window(today)}, today)
+        self._top_cache.clear()
+
+    def _window(self, today):
+        return [today - timedelta(days=days) for days in range(self.window_days)]
+
+    def _record(self, points, day):
+        raise NotImplementedError
+
+    def _top(self, board, today):
+        raise NotImplementedError
+
+    def _rank(self, board, username, today):
+        raise NotImplementedError
+
+    def _replace(self, all_points, day_points, today):
+        raise NotImplementedError
+
+
+class RedisLeaderboard(BaseLeaderboard):
+    """boards are sorted sets in the redis of `REDIS_URL`
+
+    a game is recorded by one lua script, which also updates today's recent board
+    when it was built already
+    """
+    ALL_KEY = 'leaderboard:all'
+    DAY_KEY = 'leaderboard:day:{:%Y%m%d}'
+    RECENT_KEY = 'leaderboard:recent:{:%Y%m%d}'
+    RECORD_SCRIPT = """
+        local recent = redis.call('EXISTS', KEYS[3]) == 1
+        for i = 2, #ARGV, 2 do
+            redis.call('ZINCRBY', KEYS[1], ARGV[i + 1], ARGV[i])
+            redis.call('ZINCRBY', KEYS[2], ARGV[i + 1], ARGV[i])
+            if recent then
+                redis.call('ZINCRBY', KEYS[3], ARGV[i + 1], ARGV[i])
+            end
+        end
+        redis.call('EXPIRE', KEYS[2], ARGV[1])
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        from mysite.redis_client import get_redis
+        self.redis = get_redis()
+        self._record_script = self.redis.register_script(self.RECORD_SCRIPT)
+
+    def _record(self, points, day):
+        args = [self.window_days * 24 * 60 * 60 + 24 * 60 * 60]
+        for username, point in points.items():
+            args += [username, point]
+        self._record_script(keys=[self.ALL_KEY, self.DAY_KEY.format(day), self.RECENT_KEY.format(day)], args=args)
+
+    def _top(self, board, today):
+        entries = self.redis.zrevrange(self._key(board, today), 0, self.top_size - 1, withscores=True)
+        return [(username.decode('utf8'), int(points)) for username, points in entries]
+
+    def _rank(self, board, username, today):
+        pipeline = self.redis.pipeline(transaction=False)
+        key = self._key(board, today)
+        pipeline.zrevrank(key, username)
+        pipeline.zscore(key, username)
+        rank, points = pipeline.execute()
+        return None if rank is None else (rank + 1, int(points))
+
+    def _key(self, board, today):
+        if board == ALL:
+            return self.ALL_KEY
+        key = self.RECENT_KEY.format(today)
+        if not self.redis.exists(key):
+            # a single command, a game recorded meanwhile is either summed up or added on top
+            days = [self.DAY_KEY.format(day) for day in self._window(today)]
+            pipeline = self.redis.pipeline()
+            pipeline.zunionstore(key, days)
+            pipeline.expire(key, 2 * 24 * 60 * 60)
+            pipeline.execute()
+        return key
+
+    def _replace(self, all_points, day_points, today):
+        pipeline = self.redis.pipeline()
+        pipeline.delete(self.ALL_KEY, self.RECENT_KEY.format(today),
+                        *[self.DAY_KEY.format(day) for day in self._window(today)])
+        if all_points:
+            pipeline.zadd(self.ALL_KEY, all_points)
+        for day, points in day_points.items():
+            if points:
+                pipeline.zadd(self.DAY_KEY.format(day), points)
+                pipeline.expire(self.DAY_KEY.format(day), (self.window_days + 1 - (today - day).days) * 24 * 60 * 60)
+        pipeline.execute()
+
+
+class _SortedBoard:
+    """scores kept next to a list sorted by `(-points, username)`, ranks are found by bisection"""
+
+    def __init__(self, points=None):
+        self.points = dict(points or {})
+        self.order = sorted((-point, username) for username, point in self.points.items())
+
+    def add(self, username, point):
+        old = self.points.get(username)
+        if old is not None:
+            del self.order[bisect.bisect_left(self.order, (-old, username))]
+        self.points[username] = (old or 0) + point
+        bisect.insort(self.order, (-self.points[username], username))
+
+    def top(self, count):
+        return [(username, -point) for point, username in self.order[:count]]
+
+    def rank(self, username):
+        point = self.points.get(username)
+        if point is None:
+            return None
+        return bisect.bisect_left(self.order, (-point, username)) + 1, point
+
+
+class InMemoryLeaderboard(BaseLeaderboard):
+    """single process stand-in"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._all = _SortedBoard()
+        self._days = {}
+        self._recent = (None, None)  # (day, board)
+        self._lock = threading.Lock()
+
+    def _record(self, points, day):
+        with self._lock:
+            self._days.setdefault(day, Counter()).update(points)
+            for username, point in points.items():
+                self._all.add(username, point)
+                if self._recent[0] == day:
+                    self._recent[1].add(username, point)
+
+    def _top(self, board, today):
+        with self._lock:
+            return self._board(board, today).top(self.top_size)
+
+    def _rank(self, board, username, today):
+        with self._lock:
+            return self._board(board, today).rank(username)
+
+    def _board(self, board, today):
+        if board == ALL:
+            return self._all
+        if self._recent[0] != today:
+            window = self._window(today)
+            self._days = {day: points for day, points in self._days.items() if day in window}
+            recent = Counter()
+            for points in self._days.values():
+                # `update` adds up, unlike `+` it keeps players without points
+                recent.update(points)
+            self._recent = today, _SortedBoard(recent)
+        return self._recent[1]
+
+    def _replace(self, all_points, day_points, today):
+        with self._lock:
+            self._all = _SortedBoard(all_points)
+            self._days = {day: Counter(points) for day, points in day_points.items()}
+            self._recent = (None, None)
+
+
+_leaderboard = None
+
+
+def get_leaderboard() -> BaseLeaderboard:
+    global _leaderboard
+    if _leaderboard is None:
+        config = settings.GAME_LEADERBOARD
+        _leaderboard = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _leaderboard
@@ -0,0 +1,323 @@
+"""websocket load harness behind `manage.py loadtest`
+
+Every simulated room gets its own lobby socket and one socket per player.
+The admin starts the game, then the player whose turn it is folds the first
+card of their hand until the game ends. Move latency is measured from
+sending `play_card` to receiving the resulting `room_data_updated` frame on
+the mover's socket.
+
+Sockets are opened either in process through channels' `WebsocketCommunicator`
+or against a running server with the `websockets` package.
+"""
+import asyncio
+import json
+import math
+import threading
+import time
+import uuid
+from urllib.request import Request, urlopen
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import CustomUser
+from .frames import JSON, decode
+from .models import GameRoom
+
+
+def percentile(values, q):
+    """nearest-rank percentile of `values`, q in (0, 1]"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class QueryCounter:
+    """counts the queries of every database connection opened by this process"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        connection_created.connect(self._attach)
+
+    def uninstall(self):
+        connection_created.disconnect(self._attach)
+
+    def _attach(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class InProcessSocket:
+    def __init__(self, application, path, encoding=JSON):
+        self.communicator = WebsocketCommunicator(application, path)
+        self.encoding = encoding
+        self.received_bytes = 0
+
+    async def open(self, timeout):
+        connected, code = await self.communicator.connect(timeout)
+        if not connected:
+            raise ConnectionError(f'websocket rejected ({code})')
+
+    async def send(self, data):
+        await self.communicator.send_to(text_data=json.dumps(data))
+
+    async def receive(self, timeout):
+        frame = await self.communicator.receive_from(timeout)
+        if isinstance(frame, str):
+            self.received_bytes += len(frame.encode('utf-8'))
+            return decode(frame, None, self.encoding)
+        self.received_bytes += len(frame)
+        return decode(None, frame, self.encoding)
+
+    async def close(self, timeout):
+        await self.communicator.disconnect(timeout=timeout)
+
+
+class LiveSocket:
+    def __init__(self, base_url, path, encoding=JSON):
+        self.url = base_url + path
+        self.encoding = encoding
+        self.received_bytes = 0
+        self.socket = None
+
+    async def open(self, timeout):
+        import websockets
+        self.socket = await websockets.connect(self.url, max_size=None, open_timeout=timeout)
+
+    async def send(self, data):
+        await self.socket.send(json.dumps(data))
+
+    async def receive(self, timeout):
+        frame = await asyncio.wait_for(self.socket.recv(), timeout)
+        if isinstance(frame, str):
+            self.received_bytes += len(frame.encode('utf-8'))
+            return decode(frame, None, self.encoding)
+        self.received_bytes += len(frame)
+        return decode(None, frame, self.encoding)
+
+    async def close(self, timeout):
+        await asyncio.wait_for(self.socket.close(), timeout)
+
+
+class RateLimited(Exception):
+    """the server refused an event, it may be sent again after `retry_after` seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class Player:
+    """one player socket, frames are read in the background into a queue"""
+
+    def __init__(self, socket, username):
+        self.socket = socket
+        self.username = username
+        self.frames = asyncio.Queue()
+        self._reader = None
+
+    async def open(self, timeout):
+        await self.socket.open(timeout)
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        while True:
+            try:
+                await self.frames.put(await self.socket.receive(timeout=3600))
+            except asyncio.TimeoutError:
+                continue
+
+    async def send(self, data):
+        await self.socket.send(data)
+
+    def discard_frames(self):
+        while not self.frames.empty():
+            self.frames.get_nowait()
+
+    async def room_update(self, timeout, accept=lambda room_data: True):
+        """next `room_data_updated` frame whose room data satisfies `accept`
+
+        :raises
+            RateLimited: the server refused the event sent before
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = await asyncio.wait_for(self.frames.get(), max(0.0, deadline - time.monotonic()))
+            if frame.get('event') == 'room_data_updated' and accept(frame['room_data']):
+                return frame['room_data']
+            if frame.get('event') == 'rate_limited':
+                raise RateLimited(frame['retry_after'])
+
+    async def close(self, timeout):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self.socket.close(timeout)
+
+
+class LoadTest:
+    """
+    :parms
+        open_socket: callable(path) returning an unopened socket, the frame encoding is asked with the query string
+        create_room: coroutine function(user, volume) returning the new room's permanent_url
+        rooms: number of rooms played concurrently (Int)
+        players: players per room (Int)
+        max_moves: stop a game after this many moves, 0 plays it to the end (Int)
+        timeout: seconds to wait for any single broadcast (Float)
+        encoding: frame encoding asked for, see `game.frames` (Str)
+    """
+
+    def __init__(self, open_socket, create_room, rooms, players, max_moves=0, timeout=30.0, encoding=JSON):
+        self.open_socket = open_socket
+        self.create_room = create_room
+        self.rooms = rooms
+        self.players = players
+        self.max_moves = max_moves
+        self.timeout = timeout
+        self.encoding = encoding
+
+        self.latencies = []
+        self.received_bytes = 0
+        self.games_finished = 0
+        self.rate_limited = 0
+        self.errors = []
+
+    async def run(self, query_counter=None):
+        users = await database_sync_to_async(self._create_users)()
+
+        started = time.perf_counter()
+        queries_before = 0 if query_counter is None else query_counter.count
+        await asyncio.gather(*(self._play_room(room_users) for room_users in users))
+        elapsed = time.perf_counter() - started
+
+        moves = len(self.latencies)
+        queries = None if query_counter is None else query_counter.count - queries_before
+        return {
+            'rooms': self.rooms,
+            'players_per_room': self.players,
+            'games_finished': self.games_finished,
+            'errors': len(self.errors),
+            'rate_limited': self.rate_limited,
+            'moves': moves,
+            'elapsed_s': elapsed,
+            'moves_per_s': moves / elapsed if elapsed else 0,
+            'latency_p50_ms': self._ms(percentile(self.latencies, 0.50)),
+            'latency_p95_ms': self._ms(percentile(self.latencies, 0.95)),
+            'latency_p99_ms': self._ms(percentile(self.latencies, 0.99)),
+            'received_bytes': self.received_bytes,
+            'db_queries': queries,
+            'db_queries_per_move': None if queries is None or not moves else queries / moves,
+        }
+
+    @staticmethod
+    def _ms(seconds):
+        return None if seconds is None else seconds * 1000
+
+    def _create_users(self):
+        run_id = uuid.uuid4().hex[:6]
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'load-{run_id}-{room}-{seat}', password='!')
+            for room in range(self.rooms) for seat in range(self.players)
+        ])
+        if users and users[0].pk is None:
+            # backends without RETURNING
+            users = list(CustomUser.objects.filter(username__startswith=f'load-{run_id}-'))
+            users.sort(key=lambda user: tuple(int(part) for part in user.username.split('-')[2:]))
+        return [users[i:i + self.players] for i in range(0, len(users), self.players)]
+
+    def _path(self, path, user):
+        return f'{path}?token={AccessToken.for_user(user)}&encoding={self.encoding}'
+
+    async def _play_room(self, users):
+        sockets = []
+        try:
+            lobby = Player(self.open_socket(self._path('/ws/lobby/', users[0])), users[0].username)
+            await lobby.open(self.timeout)
+            sockets.append(lobby)
+
+            room_name = await self.create_room(users[0], len(users))
+            players = {}
+            for user in users:
+                player = Player(self.open_socket(self._path(f'/ws/game/{room_name}/', user)), user.username)
+                await player.open(self.timeout)
+                sockets.append(player)
+                players[user.username] = player
+
+            admin = players[users[0].username]
+            await admin.send({'event': 'status_change', 'message': 'playing'})
+            room_data = await admin.room_update(self.timeout, lambda data: data['status'] == 'playing')
+
+            moves = 0
+            while room_data['status'] == 'playing' and (not self.max_moves or moves < self.max_moves):
+                room_data = await self._fold(players, room_data)
+                moves += 1
+
+            if room_data['status'] == 'end':
+                self.games_finished += 1
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            for socket in sockets:
+                self.received_bytes += socket.socket.received_bytes
+                try:
+                    await socket.close(self.timeout)
+                except Exception as e:
+                    self.errors.append(e)
+
+    async def _fold(self, players, room_data):
+        game_data = room_data['game_data']
+        mover = players[game_data['now_play']]
+        hand = next(player for player in game_data['player_list'] if player['id'] == mover.username)['hand_cards']
+        before = (game_data['round'], game_data['turn'])
+        # frames still queued from earlier moves are older than the one awaited
+        mover.discard_frames()
+
+        sent = time.perf_counter()
+        while True:
+            await mover.send({'event': 'play_card', 'id': hand[0]['card_no'], 'pos': -1, 'rotate': 0, 'act': -1})
+            try:
+                room_data = await mover.room_update(
+                    self.timeout,
+                    lambda data: data['status'] == 'end' or
+                    data['status'] == 'playing' and (data['game_data']['round'], data['game_data']['turn']) > before
+                )
+                break
+            except RateLimited as e:
+                # as a client would, the wait counts into the move's latency
+                self.rate_limited += 1
+                await asyncio.sleep(e.retry_after)
+        self.latencies.append(time.perf_counter() - sent)
+        return room_data
+
+
+def in_process_room_factory():
+    async def create_room(user, volume):
+        room = await database_sync_to_async(GameRoom.objects.create)(volume=volume)
+        return room.permanent_url
+    return create_room
+
+
+def live_room_factory(http_url):
+    def post(user, volume):
+        request = Request(
+            f'{http_url}/api/game/room_create/',
+            data=json.dumps({'volume': volume}).encode('utf-8'),
+            headers={'Authorization': f'JWT {AccessToken.for_user(user)}', 'Content-Type': 'application/json'},
+            method='POST',
+        )
+        with urlopen(request) as response:
+            return json.loads(response.read())['permanent_url']
+
+    async def create_room(user, volume):
+        return await asyncio.get_running_loop().run_in_executor(None, post, user, volume)
+    return create_room
@@ -0,0 +1,100 @@
+import asyncio
+
+from channels.routing import get_default_application
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from game.frames import ENCODINGS, JSON
+from game.loadtest import (
+    InProcessSocket, LiveSocket, LoadTest, QueryCounter, in_process_room_factory, live_room_factory
+)
+
+
+class Command(BaseCommand):
+    help = 'Play many concurrent games through the websocket API and report move latency, ' \
+           'throughput and database queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=100, help='Rooms played concurrently.')
+        parser.add_argument('--players', type=int, default=4, help='Players per room, 3 to 10.')
+        parser.add_argument(
+            '--moves', type=int, default=0,
+            help='Stop every game after this many moves, 0 plays the games to the end.',
+        )
+        parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for a broadcast.')
+        parser.add_argument('--encoding', choices=ENCODINGS, default=JSON, help='Websocket frame encoding.')
+        parser.add_argument(
+            '--url',
+            help='Base websocket url of a running server, e.g. ws://localhost:8000. '
+                 'Without it the ASGI application is driven in this process.',
+        )
+        parser.add_argument(
+            '--http-url',
+            help='Base http url used to create rooms on the running server, defaults to --url over http.',
+        )
+        parser.add_argument(
+            '--in-memory', action='store_true',
+            help='In process only: use the in-memory channel layer and in-memory game backends, '
+                 'so neither redis nor a running server is needed.',
+        )
+
+    def handle(self, *args, **options):
+        if not 3 <= options['players'] <= 10:
+            raise CommandError('--players must be between 3 and 10.')
+        if options['rooms'] < 1:
+            raise CommandError('--rooms must be at least 1.')
+
+        query_counter = None
+        if options['url']:
+            if options['in_memory']:
+                raise CommandError('--in-memory only applies to the in process mode.')
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError('The live mode needs the `websockets` package.')
+
+            base_url = options['url'].rstrip('/')
+            http_url = (options['http_url'] or 'http' + base_url[len('ws'):]).rstrip('/')
+
+            def open_socket(path):
+                return LiveSocket(base_url, path, options['encoding'])
+
+            create_room = live_room_factory(http_url)
+        else:
+            if options['in_memory']:
+                settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+                settings.GAME_STATE_STORE = {'BACKEND': 'game.state_store.InMemoryStateStore',
+                                             'OPTIONS': {'ttl': 86400}}
+                settings.GAME_LEADERBOARD = {'BACKEND': 'game.leaderboard.InMemoryLeaderboard'}
+                settings.GAME_RESUME_BUFFER = {'BACKEND': 'game.resume.InMemoryResumeBuffer'}
+            application = get_default_application()
+
+            def open_socket(path):
+                return InProcessSocket(application, path, options['encoding'])
+
+            create_room = in_process_room_factory()
+            # queries of a live server happen in its own process and can not be counted from here
+            query_counter = QueryCounter()
+            query_counter.install()
+
+        load_test = LoadTest(
+            open_socket, create_room,
+            rooms=options['rooms'],
+            players=options['players'],
+            max_moves=options['moves'],
+            timeout=options['timeout'],
+            encoding=options['encoding'],
+        )
+        try:
+            report = asyncio.run(load_test.run(query_counter))
+        finally:
+            if query_counter is not None:
+                query_counter.uninstall()
+
+        for error in load_test.errors[:5]:
+            self.stderr.write(f'{type(error).__name__}: {error}')
+
+        for key, value in report.items():
+            if isinstance(value, float):
+                value = f'{value:.2f}'
+            self.stdout.write(f'{key:<22}{"n/a" if value is None else value}')
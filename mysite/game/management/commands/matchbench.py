@@ -0,0 +1,84 @@
+import time
+import uuid
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from authentication.models import CustomUser
+from game.loadtest import QueryCounter, percentile
+from game.matchmaking import VOLUMES, Matchmaker, Ticket
+from game.models import GameRoom
+
+
+class Command(BaseCommand):
+    help = 'Queue synthetic players, match them into rooms in batches and report matches per second. ' \
+           'Rooms and players are created in the configured database and removed afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=10000, help='Players queued.')
+        parser.add_argument(
+            '--volumes', default='4',
+            help='Comma separated room sizes, players are spread over their queues evenly.',
+        )
+        parser.add_argument('--batch-size', type=int, default=200, help='Most rooms created by one batch.')
+        parser.add_argument('--keep', action='store_true', help='Keep the created rooms and players.')
+
+    def handle(self, *args, **options):
+        try:
+            volumes = [int(volume) for volume in options['volumes'].split(',')]
+        except ValueError:
+            volumes = []
+        if not volumes or any(volume not in VOLUMES for volume in volumes):
+            raise CommandError(f'--volumes must be sizes between {VOLUMES[0]} and {VOLUMES[-1]}.')
+        if options['players'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--players and --batch-size must be at least 1.')
+
+        run_id = uuid.uuid4().hex[:6]
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'match-{run_id}-{player}', password='!') for player in range(options['players'])
+        ])
+        user_ids = CustomUser.objects.filter(username__startswith=f'match-{run_id}-').values_list('pk', flat=True)
+
+        notified = []
+        matchmaker = Matchmaker(lambda channel_name, message: notified.append(message), options['batch_size'])
+        for index, user_id in enumerate(user_ids):
+            matchmaker.enqueue(Ticket(user_id, f'bench.{user_id}'), volumes[index % len(volumes)])
+
+        query_counter = QueryCounter()
+        batch_seconds, rooms = [], 0
+        try:
+            with connection.execute_wrapper(query_counter):
+                started = time.perf_counter()
+                while True:
+                    batch_started = time.perf_counter()
+                    created = matchmaker.match()
+                    if not created:
+                        break
+                    batch_seconds.append(time.perf_counter() - batch_started)
+                    rooms += created
+                elapsed = time.perf_counter() - started
+        finally:
+            if not options['keep']:
+                GameRoom.objects.filter(playerdata__player__username__startswith=f'match-{run_id}-').delete()
+                CustomUser.objects.filter(username__startswith=f'match-{run_id}-').delete()
+
+        report = {
+            'rooms': rooms,
+            'players_matched': len(notified),
+            'players_left': matchmaker.waiting(),
+            'batches': len(batch_seconds),
+            'seconds': elapsed,
+            'matches_per_s': rooms / elapsed if elapsed else None,
+            'players_per_s': len(notified) / elapsed if elapsed else None,
+            'batch_p50_ms': self._ms(percentile(batch_seconds, 0.5)),
+            'batch_p95_ms': self._ms(percentile(batch_seconds, 0.95)),
+            'db_queries_per_batch': query_counter.count / len(batch_seconds) if batch_seconds else None,
+        }
+        for key, value in report.items():
+            if isinstance(value, float):
+                value = f'{value:.2f}'
+            self.stdout.write(f'{key:<22}{"n/a" if value is None else value}')
+
+    @staticmethod
+    def _ms(seconds):
+        return None if seconds is None else seconds * 1000
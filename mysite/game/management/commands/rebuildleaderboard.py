@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from game.leaderboard import get_leaderboard
+from game.models import GameRoom, PlayerData, PlayerSummary
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the leaderboard from the database, see `game.leaderboard`.'
+
+    def handle(self, *args, **options):
+        leaderboard = get_leaderboard()
+        all_points = dict(
+            PlayerSummary.objects.values_list('player__username', 'points').iterator()
+        )
+
+        # a finished room is not updated anymore, its `updated_at` is when the game ended
+        since = timezone.localdate() - timedelta(days=leaderboard.window_days - 1)
+        day_points = {}
+        rows = PlayerData.objects.filter(room__status=GameRoom.StatusType.END, room__updated_at__date__gte=since) \
+            .annotate(day=TruncDate('room__updated_at')) \
+            .values_list('day', 'player__username') \
+            .annotate(points=Sum('point')).order_by()
+        for day, username, points in rows.iterator():
+            day_points.setdefault(day, {})[username] = points
+
+        leaderboard.replace(all_points, day_points)
+        self.stdout.write(f'players={len(all_points)} recent_days={len(day_points)}')
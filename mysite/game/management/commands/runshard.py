@@ -0,0 +1,66 @@
+import logging
+import os
+import socket
+
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import get_default_application
+from channels.worker import Worker
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from game.sharding import ShardHeartbeat, clean_worker_id, get_shard_router, shard_channel
+
+logger = logging.getLogger('django.channels.worker')
+
+
+class Command(BaseCommand):
+    help = 'Run game shard worker(s), each one applying the events of the rooms hashed onto it.'
+    leave_locale_alone = True
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--layer',
+            action='store',
+            dest='layer',
+            default=DEFAULT_CHANNEL_LAYER,
+            help='Channel layer alias to use, if not the default.',
+        )
+        parser.add_argument(
+            'worker_ids', nargs='*',
+            help='Worker ids served by this process, defaults to <hostname>-<pid>. '
+                 'Several ids let one process stand in for several workers.',
+        )
+
+    def handle(self, *args, **options):
+        router = get_shard_router()
+        if router is None:
+            raise CommandError('GAME_SHARDING is not enabled.')
+
+        if not router.registry.shared:
+            raise CommandError(f'{type(router.registry).__name__} is only seen by its own process, '
+                               f'the web server would never forward to these workers.')
+
+        channel_layer = get_channel_layer(options['layer'])
+        if channel_layer is None:
+            raise CommandError('You do not have any CHANNEL_LAYERS configured.')
+        if isinstance(channel_layer, InMemoryChannelLayer):
+            raise CommandError('The in-memory channel layer is only seen by its own process, '
+                               'the web server would never reach these workers.')
+
+        worker_ids = [clean_worker_id(worker_id) for worker_id in options['worker_ids']] or \
+            [clean_worker_id(f'{socket.gethostname()}-{os.getpid()}')]
+
+        router.local_workers = frozenset(worker_ids)
+        heartbeat = ShardHeartbeat(router.registry, worker_ids, settings.GAME_SHARDING['HEARTBEAT_INTERVAL'])
+        heartbeat.start()
+
+        logger.info('Running shard workers %s', worker_ids)
+        try:
+            Worker(
+                application=get_default_application(),
+                channels=[shard_channel(worker_id) for worker_id in worker_ids],
+                channel_layer=channel_layer,
+            ).run()
+        finally:
+            heartbeat.stop()
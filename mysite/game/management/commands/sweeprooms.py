@@ -0,0 +1,25 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from game.sweeper import sweep_rooms
+
+
+class Command(BaseCommand):
+    help = 'Expire abandoned rooms and archive finished games, see `game.sweeper`.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep sweeping every this many seconds, 0 sweeps once.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            counts = sweep_rooms()
+            self.stdout.write(' '.join(f'{step}={count}' for step, count in counts.items()))
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
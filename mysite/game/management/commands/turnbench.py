@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from game.loadtest import percentile
+from game.turn_timers import TimingWheel, TurnTimer
+
+
+class Command(BaseCommand):
+    help = 'Drive a turn timer with synthetic room deadlines and report its scheduling cost, ' \
+           'firing lag and idle CPU. Nothing is folded, the database is not used.'
+
+    def add_arguments(self, parser):
+        config = settings.TURN_TIMER
+        parser.add_argument('--rooms', type=int, default=50000, help='Rooms with a pending deadline.')
+        parser.add_argument('--spread', type=float, default=5, help='Deadlines are spread over this many seconds.')
+        parser.add_argument('--idle', type=float, default=3,
+                            help='Seconds CPU is measured with every deadline far ahead.')
+        parser.add_argument('--tick', type=float, default=config['TICK'], help='Wheel resolution in seconds.')
+        parser.add_argument('--slots', type=int, default=config['SLOTS'], help='Slots per wheel level.')
+        parser.add_argument('--levels', type=int, default=config['LEVELS'], help='Wheel levels.')
+
+    def handle(self, *args, **options):
+        if options['rooms'] < 1 or options['tick'] <= 0 or options['slots'] < 2 or options['levels'] < 1:
+            raise CommandError('--rooms, --tick, --slots and --levels must be positive, --slots at least 2.')
+        rooms = [f'bench{room}' for room in range(options['rooms'])]
+
+        lags = []
+        fired = threading.Event()
+
+        def expire(key, deadline, payload):
+            lags.append(time.monotonic() - deadline)
+            if len(lags) == len(rooms):
+                fired.set()
+
+        timer = TurnTimer(TimingWheel(options['tick'], options['slots'], options['levels']), 0, expire)
+        timer.start()
+        try:
+            # every room moves once, then a second time, as a game does
+            now = time.monotonic()
+            started = time.perf_counter()
+            for room in rooms:
+                timer.schedule(room, now + 3600)
+            schedule_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            for room in rooms:
+                timer.schedule(room, now + 7200)
+            reschedule_seconds = time.perf_counter() - started
+
+            cpu_started, idle_started = time.process_time(), time.perf_counter()
+            time.sleep(options['idle'])
+            idle_cpu = (time.process_time() - cpu_started) / (time.perf_counter() - idle_started)
+
+            now = time.monotonic()
+            for room in rooms:
+                timer.schedule(room, now + random.uniform(0, options['spread']))
+            fired.wait(options['spread'] + options['tick'] * 2 + 60)
+
+            started = time.perf_counter()
+            for room in rooms:
+                timer.schedule(room, now + 3600)
+            for room in rooms:
+                timer.cancel(room)
+            cancel_seconds = (time.perf_counter() - started) / 2
+        finally:
+            timer.stop()
+            timer.join()
+
+        report = {
+            'rooms': len(rooms),
+            'fired': len(lags),
+            'schedule_us': schedule_seconds / len(rooms) * 1e6,
+            'reschedule_us': reschedule_seconds / len(rooms) * 1e6,
+            'cancel_us': cancel_seconds / len(rooms) * 1e6,
+            'idle_cpu_pct': idle_cpu * 100,
+            'lag_p50_ms': self._ms(percentile(lags, 0.5)),
+            'lag_p95_ms': self._ms(percentile(lags, 0.95)),
+            'lag_max_ms': self._ms(max(lags, default=None)),
+        }
+        for key, value in report.items():
+            if isinstance(value, float):
+                value = f'{value:.2f}'
+            self.stdout.write(f'{key:<22}{"n/a" if value is None else value}')
+
+    @staticmethod
+    def _ms(seconds):
+        return None if seconds is None else seconds * 1000
@@ -0,0 +1,168 @@
+"""matchmaking of players waiting for a game of a given size
+
+Waiting players are queued per room size in the memory of the process their
+socket is connected to. A batcher thread takes the full groups off the queues
+every `MATCHMAKING['INTERVAL']` seconds and creates their rooms at once: one
+room id reservation, one insert of the rooms and one of their `PlayerData`.
+Every matched player then gets a single `match_found` message naming the room
+to connect to, where the first player of the group is the admin.
+
+Queues are not shared between processes, players are only matched with players
+connected to the same process.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import GameRoom, PlayerData, RoomIdCounter
+
+logger = logging.getLogger(__name__)
+
+VOLUMES = range(3, 11)
+
+
+class Ticket:
+    """a player waiting in a queue, `channel_name` receives the `match_found` message"""
+    __slots__ = ('user_id', 'channel_name')
+
+    def __init__(self, user_id, channel_name):
+        self.user_id = user_id
+        self.channel_name = channel_name
+
+
+class Matchmaker:
+    """
+    :parms
+        notify: called with `(channel_name, message)` for every matched player (Callable)
+        batch_size: most rooms created by one `match` (Int)
+    """
+
+    def __init__(self, notify, batch_size=200):
+        self.notify = notify
+        self.batch_size = batch_size
+        self._queues = {volume: OrderedDict() for volume in VOLUMES}  # user_id to Ticket, oldest first
+        self._lock = threading.Lock()
+
+    def enqueue(self, ticket: Ticket, volume: int) -> int:
+        """queue `ticket` for a room of `volume` players, a user waits in one queue only
+
+        :returns
+            players waiting in the queue, `ticket` included (Int)
+        """
+        with self._lock:
+            for queue in self._queues.values():
+                queue.pop(ticket.user_id, None)
+            queue = self._queues[volume]
+            queue[ticket.user_id] = ticket
+            return len(queue)
+
+    def cancel(self, user_id, channel_name):
+        """leave the queue, unless the user queued again from another channel meanwhile"""
+        with self._lock:
+            for queue in self._queues.values():
+                ticket = queue.get(user_id)
+                if ticket is not None and ticket.channel_name == channel_name:
+                    del queue[user_id]
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def match(self) -> int:
+        """create the rooms of up to `batch_size` full groups and notify their players
+
+        :returns
+            number of rooms created (Int)
+        """
+        groups = []
+        with self._lock:
+            for volume, queue in self._queues.items():
+                while len(queue) >= volume and len(groups) < self.batch_size:
+                    groups.append([queue.popitem(last=False)[1] for _ in range(volume)])
+        if not groups:
+            return 0
+
+        try:
+            rooms = self._create_rooms(groups)
+        except Exception:
+            self._requeue(groups)
+            raise
+
+        for room, group in zip(rooms, groups):
+            for ticket in group:
+                self.notify(ticket.channel_name, {'type': 'match_found', 'room_name': room.permanent_url})
+        return len(rooms)
+
+    def _create_rooms(self, groups):
+        rooms = [GameRoom(volume=len(group), admin_id=group[0].user_id) for group in groups]
+        # before the transaction, inside it the counter row would stay locked until the commit
+        for room, permanent_url in zip(rooms, RoomIdCounter.allocate(len(rooms))):
+            room.permanent_url = permanent_url
+        with transaction.atomic():
+            # full rooms are of no interest to the lobby, it is not notified
+            GameRoom.objects.bulk_create_rooms(rooms)
+            PlayerData.objects.bulk_create([
+                PlayerData(room=room, player_id=ticket.user_id)
+                for room, group in zip(rooms, groups) for ticket in group
+            ])
+        return rooms
+
+    def _requeue(self, groups):
+        """put the players of `groups` back in front, they keep their turn"""
+        with self._lock:
+            for group in reversed(groups):
+                queue = self._queues[len(group)]
+                for ticket in reversed(group):
+                    if ticket.user_id not in queue:
+                        queue[ticket.user_id] = ticket
+                        queue.move_to_end(ticket.user_id, last=False)
+
+
+class MatchmakingBatcher(threading.Thread):
+    """runs `matchmaker.match` every `interval` seconds until stopped"""
+
+    def __init__(self, matchmaker, interval):
+        super().__init__(name='matchmaking-batcher', daemon=True)
+        self.matchmaker = matchmaker
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                # keep going while full batches are waiting
+                while self.matchmaker.match() == self.matchmaker.batch_size:
+                    pass
+            except Exception:
+                logger.exception('Matchmaking failed')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def send_to_channel(channel_name, message):
+    async_to_sync(get_channel_layer().send)(channel_name, message)
+
+
+_matchmaker = None
+_matchmaker_lock = threading.Lock()
+
+
+def get_matchmaker() -> Matchmaker:
+    """the process' matchmaker, its batcher thread is started on first use"""
+    global _matchmaker
+    if _matchmaker is None:
+        with _matchmaker_lock:
+            if _matchmaker is None:
+                config = settings.MATCHMAKING
+                matchmaker = Matchmaker(send_to_channel, config['BATCH_SIZE'])
+                MatchmakingBatcher(matchmaker, config['INTERVAL']).start()
+                _matchmaker = matchmaker
+    return _matchmaker
@@ -0,0 +1,103 @@
+"""metrics of the game app, see `mysite.metrics`"""
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync
+
+from django.db import connection
+from django.db.models import Count
+
+from mysite import tracing
+from mysite.metrics import COUNT_BUCKETS, Counter, Gauge, Histogram, registry
+
+# anything else a client sends is recorded as `unknown`, labels must stay bounded
+EVENTS = frozenset(['status_change', 'volume_change', 'kick_player', 'play_card', 'create_new_room'])
+
+event_seconds = Histogram(
+    'game_event_seconds', 'GameRoomConsumer.receive latency per event type.', ['event'])
+event_db_queries = Histogram(
+    'game_event_db_queries', 'Database queries run while applying one room event.', ['event'],
+    buckets=COUNT_BUCKETS)
+state_control_seconds = Histogram(
+    'game_state_control_seconds', 'GameController.state_control time.')
+room_save_seconds = Histogram(
+    'game_room_save_seconds', 'GameRoom.save time, broadcasts included.')
+group_send_seconds = Histogram(
+    'game_group_send_seconds', 'Channel layer group_send latency per message type.', ['type'])
+rate_limited_events = Counter(
+    'game_rate_limited_events', 'Websocket events dropped by the rate limits.', ['event'])
+rate_limited_closes = Counter(
+    'game_rate_limited_closes', 'Websockets closed for sending over their rate limits.')
+coalesced_events = Counter(
+    'game_coalesced_events', 'Websocket events and room updates skipped as a newer one superseded them.',
+    ['event'])
+expired_turns = Counter(
+    'game_expired_turns', 'Turns folded for a player who let the turn deadline pass.')
+turn_timer_lag_seconds = Histogram(
+    'game_turn_timer_lag_seconds', 'Delay between a turn deadline and its timer firing.')
+websocket_connections = Gauge(
+    'game_websocket_connections', 'Open websockets per consumer type.', ['consumer'])
+rooms = Gauge(
+    'game_rooms', 'Rooms per status.', ['status'])
+
+
+def event_label(text_data_json) -> str:
+    event = text_data_json.get('event') if isinstance(text_data_json, dict) else None
+    return event if event in EVENTS else 'unknown'
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries(event):
+    """record the queries run on this thread's connection inside the block"""
+    counter = _QueryCounter()
+    try:
+        with connection.execute_wrapper(counter):
+            yield
+    finally:
+        event_db_queries.labels(event).observe(counter.count)
+
+
+def group_send(channel_layer, group, message):
+    """`async_to_sync(channel_layer.group_send)` recording its latency, and a span when traced"""
+    with group_send_seconds.labels(message['type']).time(), tracing.span('group_send', type=message['type']):
+        async_to_sync(channel_layer.group_send)(group, message)
+
+
+# seconds a room count is reported again before the rooms are counted anew
+ROOMS_COLLECT_INTERVAL = 15
+_rooms_collected_at = None
+_rooms_lock = threading.Lock()
+
+
+def collect_rooms():
+    """count the rooms by status, at most once per `ROOMS_COLLECT_INTERVAL` whatever the scrapers"""
+    global _rooms_collected_at
+    with _rooms_lock:
+        now = time.monotonic()
+        if _rooms_collected_at is not None and now - _rooms_collected_at < ROOMS_COLLECT_INTERVAL:
+            return
+        _rooms_collected_at = now
+        _count_rooms()
+
+
+def _count_rooms():
+    from .models import GameRoom
+
+    counts = dict.fromkeys(GameRoom.StatusType.values, 0)
+    for status, count in GameRoom.objects.order_by().values_list('status').annotate(count=Count('pk')):
+        counts[status] = count
+    for status, count in counts.items():
+        rooms.labels(status).set(count)
+
+
+registry.add_collect_hook(collect_rooms)
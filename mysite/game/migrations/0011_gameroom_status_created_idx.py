@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_gameroom_admin'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gameroom',
+            index=models.Index(fields=['status', 'created_at'], name='game_room_status_created_idx'),
+        ),
+    ]
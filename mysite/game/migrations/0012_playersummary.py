@@ -0,0 +1,49 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_summary(apps, schema_editor):
+    GameRoom = apps.get_model('game', 'GameRoom')
+    PlayerData = apps.get_model('game', 'PlayerData')
+    PlayerSummary = apps.get_model('game', 'PlayerSummary')
+
+    summaries = {}
+    for room in GameRoom.objects.filter(status='end').only('id').iterator():
+        players_data = list(PlayerData.objects.filter(room=room).values('player_id', 'point'))
+        best = max((player_data['point'] for player_data in players_data), default=0)
+        for player_data in players_data:
+            summary = summaries.setdefault(player_data['player_id'],
+                                           PlayerSummary(player_id=player_data['player_id']))
+            summary.games_played += 1
+            summary.points += player_data['point']
+            summary.wins += int(best > 0 and player_data['point'] == best)
+
+    PlayerSummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('game', '0011_gameroom_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerSummary',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('games_played', models.IntegerField(default=0)),
+                ('points', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='playerdata',
+            index=models.Index(fields=['player', 'room'], name='game_player_room_idx'),
+        ),
+        migrations.RunPython(backfill_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.3 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+def seed_counter(apps, schema_editor):
+    GameRoom = apps.get_model('game', 'GameRoom')
+    RoomIdCounter = apps.get_model('game', 'RoomIdCounter')
+    RoomIdCounter.objects.get_or_create(name='room', defaults={'value': GameRoom.objects.count()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0012_playersummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomIdCounter',
+            fields=[
+                ('name', models.CharField(max_length=16, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='gameroom',
+            name='permanent_url',
+            field=models.CharField(default='______', max_length=6, unique=True),
+        ),
+        migrations.RunPython(seed_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-19 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0013_roomidcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameroom',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.3 on 2026-10-19 17:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0014_gameroom_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameroom',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='gameroom',
+            index=models.Index(fields=['status', 'updated_at'], name='game_room_status_updated_idx'),
+        ),
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='game.gameroom')),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.3 on 2026-10-19 18:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0015_gameroom_updated_at_gamearchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoundLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round', models.PositiveSmallIntegerField()),
+                ('snapshot', models.BinaryField()),
+                ('moves', models.BinaryField(default=b'')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='game.gameroom')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='roundlog',
+            constraint=models.UniqueConstraint(fields=('room', 'round'), name='game_roundlog_room_round_uniq'),
+        ),
+    ]
@@ -1,13 +1,57 @@
-import base64
-import hashlib
-from datetime import datetime
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
 from authentication.models import CustomUser
+from mysite import tracing
 from saboteur import GameController, GameState
+from . import metrics
+from .leaderboard import get_leaderboard
+from .resume import get_resume_buffer
+from .room_id import encode_room_id
+from .state_store import StaleStateError, get_state_store, pack_state, unpack_state
+from .turn_timers import cancel_turn, start_turn
+
+
+class StaleRoomError(Exception):
+    """the room kept changing under a compare-and-swap update"""
+
+
+class GameRoomQuerySet(models.QuerySet):
+    def with_players_length(self):
+        """annotate `players_length` with a correlated COUNT subquery
+
+        the subquery is only evaluated for rows that are actually returned,
+        so a paginated listing costs the same with ten or ten thousand rooms
+        """
+        players_length = PlayerData.objects.filter(room=OuterRef('pk')).order_by().values('room') \
+            .annotate(count=Count('pk')).values('count')
+        return self.annotate(
+            players_length=Coalesce(Subquery(players_length, output_field=models.IntegerField()), 0)
+        )
+
+    def light(self):
+        """only load the columns needed by `LightGameRoomSerializer`"""
+        return self.only('id', 'created_at', 'status', 'permanent_url', 'volume').with_players_length()
+
+    def bump_version(self, **changes):
+        """update `changes` as a new version of the rooms"""
+        return self.update(version=F('version') + 1, updated_at=timezone.now(), **changes)
+
+    def bulk_create_rooms(self, rooms):
+        """insert many rooms at once, ids come from a single counter reservation
+
+        rooms given an id already, e.g. reserved outside the caller's
+        transaction, keep it. no lobby / room notification is sent, unlike
+        `GameRoom.save()`
+        """
+        unnamed = [room for room in rooms if room.permanent_url == GameRoom.PLACEHOLDER_URL]
+        for room, permanent_url in zip(unnamed, RoomIdCounter.allocate(len(unnamed)) if unnamed else []):
+            room.permanent_url = permanent_url
+        return self.bulk_create(rooms)
 
 
 class GameRoom(models.Model):
@@ -16,7 +60,9 @@ class GameRoom(models.Model):
         PLAYING = 'playing'
         END = 'end'
 
-    HASH_SALT = 'HELLO'
+    PLACEHOLDER_URL = '______'
+    # attempts of a compare-and-swap update before giving up with `StaleRoomError`
+    MAX_RETRIES = 3
     lobby_socket_group_name = 'lobby'
 
     created_at = models.DateTimeField(auto_now_add=True)
@@ -24,29 +70,93 @@ class GameRoom(models.Model):
     volume = models.SmallIntegerField(default=4)
     players = models.ManyToManyField(CustomUser, through='PlayerData', through_fields=('room', 'player'), blank=True)
     status = models.CharField(max_length=8, choices=StatusType.choices, default=StatusType.ORGANIZE)
-    permanent_url = models.CharField(max_length=6, default='______')
+    permanent_url = models.CharField(max_length=6, unique=True, default=PLACEHOLDER_URL)
     game_data = models.JSONField(default=dict)
-
-    def save(self, *args, **kwargs):
-        if self.permanent_url == '______':
-            new_id = str(datetime.now)
-            while True:
-                new_id = base64.b64encode(hashlib.md5((new_id + self.HASH_SALT).encode('utf-8')).digest(),
-                                          altchars=b"ab")[:6].decode("utf-8")
-                if not GameRoom.objects.filter(permanent_url=new_id).exists():
-                    break
-            self.permanent_url = new_id
+    version = models.PositiveIntegerField(default=0)
+    # moved along with `version`, the sweeper expires rooms by it
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = GameRoomQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='game_room_status_created_idx'),
+            models.Index(fields=['status', 'updated_at'], name='game_room_status_updated_idx'),
+        ]
+
+    def save(self, *args, notify=True, **kwargs):
+        """insert the room, or update it if `version` still is the stored one
+
+        :parms
+            notify: broadcast the change to the room and the lobby (Bool)
+
+        :raises
+            StaleRoomError: the room was changed since it was read
+        """
+        with metrics.room_save_seconds.time(), tracing.span('save', target='database'):
+            self._save(*args, notify=notify, **kwargs)
+
+    def _save(self, *args, notify, **kwargs):
+        if not self._state.adding:
+            self._save_versioned()
+        elif self.permanent_url == self.PLACEHOLDER_URL:
+            self.permanent_url = RoomIdCounter.allocate()[0]
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+            except IntegrityError:
+                # allocated ids never repeat, but may hit one of the random ids
+                # given out before the counter existed, the next one cannot
+                self.permanent_url = RoomIdCounter.allocate()[0]
+                super().save(*args, **kwargs)
         else:
-            pass
-
-        super().save(*args, **kwargs)  # Call the "real" save() method.
-
-        self._send_update_to_game_room()
-        self._send_update_to_lobby()
+            super().save(*args, **kwargs)  # Call the "real" save() method.
+
+        if notify:
+            self._send_update_to_game_room()
+            self._send_update_to_lobby()
+
+    def save_with_retry(self, mutate, notify=True):
+        """apply `mutate` and save, re-reading the room and applying it again after a conflict
+
+        :parms
+            mutate: changes the room in place, returns False when the change does not apply (anymore)
+            notify: see `save` (Bool)
+
+        :returns
+            the change was saved, False as well when the room was deleted meanwhile (Bool)
+        """
+        for _ in range(self.MAX_RETRIES):
+            if mutate(self) is False:
+                return False
+            try:
+                self.save(notify=notify)
+                return True
+            except StaleRoomError:
+                try:
+                    self.refresh_from_db()
+                except GameRoom.DoesNotExist:
+                    return False
+        raise StaleRoomError(self.permanent_url)
+
+    def _save_versioned(self):
+        # a deferred column was neither read nor changed, `game_data` is not loaded just to be written back
+        skipped = self.get_deferred_fields() | {'created_at', 'updated_at', 'version'}
+        fields = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields
+                  if not field.primary_key and field.attname not in skipped}
+        if not GameRoom.objects.filter(pk=self.pk, version=self.version).bump_version(**fields):
+            raise StaleRoomError(self.permanent_url)
+        self.version += 1
 
     def delete(self, *args, **kwargs):
         self._send_delete_to_lobby()
         super().delete(*args, **kwargs)
+        self.forget()
+
+    def forget(self):
+        """drop what outlives the deleted row, for rooms deleted without `delete()`"""
+        get_resume_buffer().delete(self.permanent_url)
+        cancel_turn(self.permanent_url)
 
     def get_absolute_url(self):
         return reverse('game:room', args=[self.permanent_url])
@@ -57,74 +167,235 @@ class GameRoom(models.Model):
     def room_group_name(self):
         return f'game_{self.permanent_url}'
 
-    def join_room(self, username):
-        user = CustomUser.objects.get(username=username)
-        can_speak = False
-
-        if self.status == GameRoom.StatusType.ORGANIZE:
-            if len(self.players.all()) < self.volume or user in self.players.all():
-                self.players.add(user)
-                can_speak = True
-
-                if self.admin is None:
-                    self.admin = user
-
-        elif self.status == GameRoom.StatusType.PLAYING or self.status == GameRoom.StatusType.END:
-            if user in self.players.all():
-                can_speak = True
-
-        self.save()
-        return can_speak
-
-    def leave_room(self, username):
-        if self.status == GameRoom.StatusType.ORGANIZE:
-            user = CustomUser.objects.get(username=username)
-            self.players.remove(user)
-            if len(self.players.all()) > 0:
-                if self.admin == user:
-                    self.admin = self.players.all()[0]
-                self.save()
-            else:
+    def join_room(self, user):
+        """take a seat for `user`, decided under a row lock so concurrent joins cannot overfill the room
+
+        :parms
+            user: the joining user or its username (CustomUser or Str)
+
+        :returns
+            can_speak: the user is one of the room's players (Bool)
+            joined: a seat was taken by this call and the change has been broadcast (Bool)
+        """
+        if not isinstance(user, CustomUser):
+            user = CustomUser.objects.get(username=user)
+
+        with transaction.atomic():
+            room = GameRoom.objects.select_for_update().only('status', 'volume', 'admin', 'version').get(pk=self.pk)
+            seats = PlayerData.objects.filter(room=room).aggregate(
+                taken=Count('pk'), mine=Count('pk', filter=Q(player=user))
+            )
+            self.status, self.volume, self.admin_id = room.status, room.volume, room.admin_id
+
+            if seats['mine']:
+                return True, False
+            if self.status != GameRoom.StatusType.ORGANIZE or seats['taken'] >= self.volume:
+                return False, False
+
+            PlayerData.objects.create(room=self, player=user)
+            changes = {}
+            if self.admin_id is None:
+                self.admin = changes['admin'] = user
+            GameRoom.objects.filter(pk=self.pk).bump_version(**changes)
+            self.version = room.version + 1
+
+            transaction.on_commit(self._send_membership_update)
+        return True, True
+
+    def leave_room(self, user):
+        if not isinstance(user, CustomUser):
+            user = CustomUser.objects.get(username=user)
+
+        with transaction.atomic():
+            room = GameRoom.objects.select_for_update().only('status', 'admin', 'version').filter(pk=self.pk).first()
+            if room is None or room.status != GameRoom.StatusType.ORGANIZE:
+                return
+            if not PlayerData.objects.filter(room=room, player=user).delete()[0]:
+                return
+
+            next_admin = PlayerData.objects.filter(room=room).order_by('pk') \
+                .values_list('player_id', flat=True).first()
+            if next_admin is None:
                 self.delete()
+                return
+
+            changes = {}
+            if room.admin_id == user.pk:
+                self.admin_id = changes['admin_id'] = next_admin
+            GameRoom.objects.filter(pk=self.pk).bump_version(**changes)
+            self.version = room.version + 1
+
+            transaction.on_commit(self._send_membership_update)
 
     def kick_player(self, username):
-        user = CustomUser.objects.get(username=username)
-        self.players.remove(user)
-        self.save()
+        if PlayerData.objects.filter(room=self, player__username=username).delete()[0]:
+            GameRoom.objects.filter(pk=self.pk).bump_version()
+            self._send_membership_update()
 
     def change_status(self, status):
-        self.status = status
         if status == GameRoom.StatusType.PLAYING:
-            # send delete alert to lobby
-            self._send_delete_to_lobby()
-            # create new n-player GameController
-            self._init_game_data()
-            self.save()
+            def start_game(room):
+                if room.status != GameRoom.StatusType.ORGANIZE:
+                    return False
+                room.status = status
+                # create new n-player GameController
+                room._init_game_data()
+
+            # the database update decides which start wins, the hot state is only created after it
+            if self.save_with_retry(start_game, notify=False):
+                get_state_store().save(self.permanent_url, self.game_data)
+                RoundLog.objects.create(room=self, round=self.game_data['round'], snapshot=pack_state(self.game_data))
+                start_turn(self.permanent_url, self.game_data)
+                # send delete alert to lobby
+                self._send_delete_to_lobby()
+                self._send_update_to_game_room()
 
         elif status == GameRoom.StatusType.END:
-            controller = self._get_controller()
-
-            for player in controller.player_list:
-                playerData = PlayerData.objects.get(room=self, player__username=player.id)
-                playerData.point = player.point
-                playerData.save()
-
-            self.save()
-
-    def state_control(self, card_id, position, rotate, action):
+            game_data = self.get_game_data()
+            with transaction.atomic():
+                # only the first END transition records points, a repeated one must not count twice
+                ended = GameRoom.objects.filter(pk=self.pk, status=GameRoom.StatusType.PLAYING) \
+                    .bump_version(status=status, game_data=game_data)
+                if ended:
+                    self.status, self.game_data = status, game_data
+                    points = self._record_points()
+                    transaction.on_commit(lambda: get_leaderboard().record(points))
+                    last_round = RoundLog.objects.filter(room=self).aggregate(Max('round'))['round__max']
+                    if last_round is not None:
+                        self._log_round(last_round)
+
+            if ended:
+                self.version = GameRoom.objects.values_list('version', flat=True).get(pk=self.pk)
+                # final checkpoint is written, the hot state is not needed anymore
+                get_state_store().delete(self.permanent_url)
+                cancel_turn(self.permanent_url)
+                self._send_update_to_game_room()
+
+    def state_control(self, card_id, position, rotate, action, player=None, turn=None):
+        """play a move on the live state, compare-and-set against concurrent moves
+
+        :parms
+            player: when given, the move is dropped if it is not this player's turn anymore (Str)
+            turn: when given, the move is dropped if the game is past this `(round, turn)` (Tuple)
+
+        :raises
+            StaleRoomError: the state kept changing during `MAX_RETRIES` attempts
+        """
+        store = get_state_store()
+        for _ in range(self.MAX_RETRIES):
+            with tracing.span('room_fetch'):
+                seq, game_data = self._load_live_state()
+            if player is not None and game_data['now_play'] != player:
+                return None
+            if turn is not None and (game_data['round'], game_data['turn']) != tuple(turn):
+                return None
+            move = [game_data['now_play'], card_id, position, rotate, action]
+
+            with tracing.span('hydrate'):
+                controller = GameController(**game_data)
+            round_, turn_ = controller.round, controller.turn
+            # play card and get feedback
+            with metrics.state_control_seconds.time():
+                return_msg = controller.state_control(
+                    card_id=card_id, position=position, rotate=rotate, act_type=action
+                )
+
+            with tracing.span('to_dict'):
+                game_data = controller.to_dict()
+            try:
+                with tracing.span('save', target='state_store'):
+                    seq = store.save(self.permanent_url, game_data, seq, move)
+            except StaleStateError:
+                # another move got in first, replay this one on top of it
+                continue
+            self.game_data = game_data
+            if (controller.round, controller.turn) != (round_, turn_):
+                # an illegal play does not give the player more time
+                start_turn(self.permanent_url, game_data)
+
+            # determine end game or not
+            if controller.game_state == GameState.end_game:
+                self.change_status(GameRoom.StatusType.END)
+            elif controller.round != round_:
+                # round boundary checkpoint, moves are already ordered by the hot store
+                with tracing.span('save', target='database'), transaction.atomic():
+                    GameRoom.objects.filter(pk=self.pk).bump_version(game_data=game_data)
+                    self._log_round(round_, seq)
+                    RoundLog.objects.create(room=self, round=controller.round, snapshot=pack_state(game_data))
+                self._send_update_to_game_room()
+            else:
+                self._send_update_to_game_room()
+
+            return return_msg
+
+        raise StaleRoomError(self.permanent_url)
+
+    @staticmethod
+    def etag(room_name):
+        """strong validator of the room detail, None when the room does not exist
+
+        built from `version` and the hot state's sequence number, `game_data` is not read
+        """
+        room = GameRoom.objects.filter(permanent_url=room_name).values('version', 'status').first()
+        if room is None:
+            return None
+        if room['status'] == GameRoom.StatusType.PLAYING:
+            return f'{room["version"]}.{get_state_store().seq(room_name)}'
+        return str(room['version'])
+
+    def get_game_data(self):
+        """the current game state, live games are read from the hot state store
+
+        falls back to the last checkpoint in `game_data` when the store lost the room,
+        finished games moved out by the sweeper are read from their `GameArchive`
+        """
+        if self.status == GameRoom.StatusType.PLAYING:
+            live = get_state_store().load(self.permanent_url)
+            if live is not None:
+                return live[1]
+        elif self.status == GameRoom.StatusType.END and not self.game_data:
+            archive = GameArchive.objects.filter(room_id=self.pk).first()
+            if archive is not None:
+                return archive.get_game_data()
+        return self.game_data
+
+    def _load_live_state(self):
+        live = get_state_store().load(self.permanent_url)
+        if live is None:
+            # recover from the last checkpoint, this instance's copy may be older
+            live = None, GameRoom.objects.values_list('game_data', flat=True).get(pk=self.pk)
+            # the recreated state restarts at seq 0, a new version keeps `etag` from repeating
+            GameRoom.objects.filter(pk=self.pk).bump_version()
+        return live
+
+    def _log_round(self, round_, up_to_seq=None):
+        """move the logged moves of `round_` from the hot store into its `RoundLog`"""
+        store = get_state_store()
+        moves = store.moves(self.permanent_url, up_to_seq)
+        RoundLog.objects.filter(room=self, round=round_).update(moves=pack_state(moves, level=9))
+        transaction.on_commit(lambda: store.trim_moves(self.permanent_url, len(moves)))
+
+    def _record_points(self):
         controller = self._get_controller()
-        # play card and get feedback
-        return_msg = controller.state_control(card_id=card_id, position=position, rotate=rotate, act_type=action)
+        points = {player.id: player.point for player in controller.player_list}
+        best = max(points.values(), default=0)
 
-        # save result
-        self.game_data = controller.to_dict()
-        self.save()
+        players_data = list(PlayerData.objects.filter(room=self).select_related('player'))
+        for player_data in players_data:
+            player_data.point = points.get(player_data.player.username, 0)
+        PlayerData.objects.bulk_update(players_data, ['point'])
 
-        # determine end game or not
-        if controller.game_state == GameState.end_game:
-            self.change_status(GameRoom.StatusType.END)
-
-        return return_msg
+        PlayerSummary.objects.bulk_create(
+            [PlayerSummary(player_id=player_data.player_id) for player_data in players_data],
+            ignore_conflicts=True
+        )
+        for player_data in players_data:
+            PlayerSummary.objects.filter(player_id=player_data.player_id).update(
+                games_played=F('games_played') + 1,
+                points=F('points') + player_data.point,
+                wins=F('wins') + int(best > 0 and player_data.point == best)
+            )
+        return {player_data.player.username: player_data.point for player_data in players_data}
 
     def _init_game_data(self):
         controller = GameController.from_scratch(self._get_player_list())
@@ -134,14 +405,18 @@ class GameRoom(models.Model):
         return [player.username for player in self.players.all()]
 
     def _get_controller(self):
-        return GameController(**self.game_data)
+        return GameController(**self.get_game_data())
+
+    def _send_membership_update(self):
+        self._send_update_to_game_room()
+        self._send_update_to_lobby()
 
     def _send_update_to_lobby(self):
         channel_layer = get_channel_layer()
         # Send update notification to lobby
         if self.status == self.StatusType.ORGANIZE:
-            async_to_sync(channel_layer.group_send)(
-                self.lobby_socket_group_name, {
+            metrics.group_send(
+                channel_layer, self.lobby_socket_group_name, {
                     'type': 'update_room',
                     'room_name': self.permanent_url
                 }
@@ -150,27 +425,143 @@ class GameRoom(models.Model):
     def _send_delete_to_lobby(self):
         channel_layer = get_channel_layer()
         # Send update notification to lobby
-        async_to_sync(channel_layer.group_send)(
-            self.lobby_socket_group_name, {
+        metrics.group_send(
+            channel_layer, self.lobby_socket_group_name, {
                 'type': 'delete_room',
                 'room_name': self.permanent_url
             }
         )
 
     def _send_update_to_game_room(self):
+        from .serializers import GameRoomSerializer
+
+        # serialized once for the whole group and kept for reconnecting clients, who only get
+        # the updates they missed; read back as this instance may hold stale columns, the
+        # checkpoint is only loaded when the live state is gone
+        buffer = get_resume_buffer()
+        with tracing.span('serialize', target='resume_buffer'):
+            # reserved before the read, a concurrent update read later gets a higher version
+            version = buffer.next_version(self.permanent_url)
+            room = GameRoom.objects.select_related('admin').defer('game_data').filter(pk=self.pk).first()
+            room_data = None if room is None else GameRoomSerializer(room).data
+            if room is None:
+                version = None
+            else:
+                buffer.append(self.permanent_url, version, room_data)
         channel_layer = get_channel_layer()
         # Send update notification to room group
-        async_to_sync(channel_layer.group_send)(
-            self.room_group_name(), {
+        metrics.group_send(
+            channel_layer, self.room_group_name(), {
                 'type': 'update_room',
+                'version': version,
+                'room_data': room_data,
             }
         )
 
 
+class RoomIdCounter(models.Model):
+    """monotonic counter behind `GameRoom.permanent_url`"""
+    ROOM = 'room'
+
+    name = models.CharField(max_length=16, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, count=1):
+        """reserve `count` consecutive counter values and return their room ids
+
+        reserving a block for a bulk insert costs the same as reserving a
+        single id. the counter row stays locked until the transaction commits,
+        that is right after the UPDATE when called outside of one, but only at
+        the outer commit inside an outer `transaction.atomic()`, where every
+        other allocation waits for it. reserve ids before opening one
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(name=cls.ROOM).update(value=F('value') + count):
+                cls.objects.get_or_create(name=cls.ROOM)
+                cls.objects.filter(name=cls.ROOM).update(value=F('value') + count)
+            end = cls.objects.values_list('value', flat=True).get(name=cls.ROOM)
+        return [encode_room_id(value) for value in range(end - count, end)]
+
+
 class PlayerData(models.Model):
     room = models.ForeignKey(GameRoom, on_delete=models.CASCADE)
     player = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     point = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['player', 'room'], name='game_player_room_idx'),
+        ]
+
     def __str__(self):
         return f'{self.room} {self.player}'
+
+    @classmethod
+    def history_marker(cls, user):
+        """value changing whenever the rooms `user` played in, or their listed fields, change
+
+        joins always get a higher pk than every existing membership and room
+        versions only grow, so an equal marker means an equal room history
+        """
+        marker = cls.objects.filter(player=user).aggregate(
+            rooms=Count('pk'), last=Max('pk'), versions=Sum('room__version')
+        )
+        return f'{marker["rooms"]}.{marker["last"]}.{marker["versions"]}'
+
+
+class PlayerSummary(models.Model):
+    """per-user totals over finished games, maintained by `GameRoom.change_status(END)`"""
+    player = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    games_played = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.player}'
+
+
+class GameArchive(models.Model):
+    """final `game_data` of a finished room, moved out of the hot table by the sweeper"""
+    room = models.OneToOneField(GameRoom, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    # zlib compressed msgpack, see `game.state_store.pack_state`
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def from_game_data(cls, room_id, game_data):
+        return cls(room_id=room_id, data=pack_state(game_data, level=9))
+
+    def get_game_data(self):
+        return unpack_state(bytes(self.data))
+
+    def __str__(self):
+        return f'{self.room_id}'
+
+
+class RoundLog(models.Model):
+    """what a replay of one round needs
+
+    only the dealing at round start is random, the moves replay deterministically
+    from the `snapshot` taken then, see `game.replay`
+    """
+    room = models.ForeignKey(GameRoom, on_delete=models.CASCADE, related_name='rounds')
+    round = models.PositiveSmallIntegerField()
+    # both zlib compressed msgpack, see `game.state_store.pack_state`
+    snapshot = models.BinaryField()
+    # [player, card_id, position, rotate, action] per move, written once the round is over
+    moves = models.BinaryField(default=b'')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'round'], name='game_roundlog_room_round_uniq'),
+        ]
+
+    def get_snapshot(self):
+        return unpack_state(bytes(self.snapshot))
+
+    def get_moves(self):
+        return unpack_state(bytes(self.moves)) if self.moves else []
+
+    def __str__(self):
+        return f'{self.room_id} round {self.round}'
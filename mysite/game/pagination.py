@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class RoomCursorPagination(CursorPagination):
+    """keyset pagination over rooms, newest first
+
+    the cursor encodes the last seen `created_at`, so every page is an index
+    range scan instead of an OFFSET over all previous rows
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,120 @@
+"""limits on the events game sockets may send
+
+Every event type has a token bucket per socket and one per user, shared by
+all sockets of the user connected to this process. An event is only handled
+when both buckets hold a token, otherwise the sender gets a `rate_limited`
+event saying when to retry. A socket going over its limits `MAX_VIOLATIONS`
+times within `VIOLATION_WINDOW` seconds is closed.
+
+Limits are `(tokens per second, burst)` pairs configured per event type in
+`WEBSOCKET_RATE_LIMITS`, `default` applies to the other events.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, now) -> float:
+        """take a token
+
+        :returns
+            0 when a token was taken, else seconds until the next one (Float)
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class UserBuckets:
+    """bounded LRU of the per-user buckets, shared by the consumer threads"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, user_id, event, limit, now) -> float:
+        with self._lock:
+            key = (user_id, event)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(*limit)
+                while len(self._buckets) > self.max_size:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+user_buckets = UserBuckets(max_size=getattr(settings, 'WEBSOCKET_USER_CACHE_SIZE', 10000))
+
+
+class RateLimiter:
+    """the limits of one socket
+
+    :parms
+        user_id: pk of the socket's user, None for anonymous sockets (Int)
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.config = settings.WEBSOCKET_RATE_LIMITS
+        self._buckets = {}
+        self._violations = deque()
+
+    def check(self, event: str) -> float:
+        """take a token for `event` from the socket's and the user's bucket
+
+        :parms
+            event: a `game.metrics.event_label`, so the number of buckets stays bounded (Str)
+
+        :returns
+            0 when the event may be handled, else seconds until it may be sent again (Float)
+        """
+        now = time.monotonic()
+        socket_bucket = self._buckets.get(event)
+        if socket_bucket is None:
+            socket_bucket = self._buckets[event] = TokenBucket(*self._limit('SOCKET', event))
+
+        retry_after = socket_bucket.take(now)
+        if not retry_after and self.user_id is not None:
+            retry_after = user_buckets.take(self.user_id, event, self._limit('USER', event), now)
+            if retry_after:
+                # the event is not handled, it must not count against the socket
+                socket_bucket.give_back()
+
+        if retry_after:
+            self._violations.append(now)
+        return retry_after
+
+    def abusive(self) -> bool:
+        """the socket kept sending over its limits"""
+        limit = time.monotonic() - self.config['VIOLATION_WINDOW']
+        while self._violations and self._violations[0] < limit:
+            self._violations.popleft()
+        return len(self._violations) > self.config['MAX_VIOLATIONS']
+
+    def _limit(self, scope, event):
+        limits = self.config[scope]
+        return limits.get(event, limits['default'])
@@ -0,0 +1,64 @@
+"""step through finished games
+
+A game is logged as one `RoundLog` per round: the state the round was dealt
+with and the moves played in it. A replay rebuilds the board move by move
+from them, so it only holds the current round's log, the next round's row and
+one `GameController` at a time, however long the game was.
+
+Dealing a new round is random and can not be replayed, the state after a
+round's last move is taken from the next round's snapshot instead, or from the
+room's final `game_data` after the last move of the game.
+
+Events, one per line of the NDJSON stream:
+
+    {"type": "round", "round": 2, "move": 0, "state": {...}}
+        the state after `move` moves of the round, sent once per round
+    {"type": "move", "round": 2, "move": 1, "player": "...", "card_id": 3,
+     "position": 12, "rotate": 0, "action": -1, "state": {...}}
+        a move and the state it led to, `move` counts from 1
+"""
+from saboteur import GameController, GameState
+from .models import RoundLog
+
+
+def replay_events(room, from_round=1, from_move=0):
+    """yield the replay events of a finished `room`
+
+    :parms
+        room: the finished GameRoom (GameRoom)
+        from_round: round to start from, earlier rounds are not read (Int)
+        from_move: moves of `from_round` replayed without being sent, the first event
+            holds the state after them (Int)
+    """
+    # the current row plus the one ahead, whose snapshot ends the current round
+    logs = RoundLog.objects.filter(room=room, round__gte=from_round).order_by('round').iterator(chunk_size=2)
+    log, skip = next(logs, None), from_move
+    while log is not None:
+        following = next(logs, None)
+        controller = GameController(**log.get_snapshot())
+        moves = log.get_moves()
+        skip = min(skip, len(moves))
+        if not skip:
+            yield {'type': 'round', 'round': log.round, 'move': 0, 'state': controller.to_dict()}
+
+        for index, (player, card_id, position, rotate, action) in enumerate(moves, 1):
+            controller.state_control(card_id=card_id, position=position, rotate=rotate, act_type=action)
+            if index < skip:
+                continue
+
+            round_over = controller.round != log.round or controller.game_state == GameState.end_game
+            if round_over:
+                state = following.get_snapshot() if following is not None else room.get_game_data()
+            else:
+                state = controller.to_dict()
+            if index == skip:
+                yield {'type': 'round', 'round': log.round, 'move': index, 'state': state}
+            else:
+                yield {
+                    'type': 'move', 'round': log.round, 'move': index, 'player': player, 'card_id': card_id,
+                    'position': position, 'rotate': rotate, 'action': action, 'state': state,
+                }
+            if round_over:
+                break
+
+        log, skip = following, 0
@@ -0,0 +1,172 @@
+"""recent room updates kept for reconnecting clients
+
+Every room update sent to a room group is serialized once and appended to
+the room's ring buffer of the last `size` updates. Its version is reserved
+with `next_version` before the room is read, so an update read later never
+carries a lower version than one read earlier. Updates of concurrent senders
+may be appended out of order. Clients get the version with every
+`room_data_updated` frame and send the last one seen when reconnecting. The
+consumer then replays only the updates the client missed, or sends one
+snapshot when the buffer rolled over or one of them is not appended yet,
+without joining the room again nor notifying anybody.
+
+The version restarts from 0 when the buffer loses the room, e.g. after its
+`ttl` or a redis restart.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .state_store import pack_state, unpack_state
+
+
+class BaseResumeBuffer:
+    """
+    :parms
+        size: updates kept per room (Int)
+        ttl: seconds the updates of an idle room are kept (Int)
+    """
+
+    def __init__(self, size=32, ttl=24 * 60 * 60):
+        self.size = size
+        self.ttl = ttl
+
+    def next_version(self, room_name: str) -> int:
+        """reserve the version of the next update of `room_name`, before reading the room"""
+        raise NotImplementedError
+
+    def append(self, room_name: str, version: int, room_data: dict):
+        """keep `room_data` as the update `version` of `room_name`"""
+        raise NotImplementedError
+
+    def version(self, room_name: str) -> int:
+        """the newest version reserved, 0 before the first"""
+        raise NotImplementedError
+
+    def since(self, room_name: str, version: int):
+        """the updates after `version`
+
+        :returns
+            latest: the version of the newest update (Int)
+            updates: `(version, room_data)` in order, None when some were dropped already (List)
+        """
+        raise NotImplementedError
+
+    def delete(self, room_name: str):
+        raise NotImplementedError
+
+    @staticmethod
+    def _pack(version, room_data):
+        return version.to_bytes(8, 'big') + pack_state(room_data)
+
+    @staticmethod
+    def _after(version, latest, entries):
+        # entries hold the last updates appended, each prefixed by its version
+        missed = {}
+        for entry in entries:
+            entry_version = int.from_bytes(entry[:8], 'big')
+            if version < entry_version <= latest:
+                missed[entry_version] = entry[8:]
+        if version > latest or len(missed) != latest - version:
+            return None
+        return [(entry_version, unpack_state(missed[entry_version])) for entry_version in range(version + 1, latest + 1)]
+
+
+class RedisResumeBuffer(BaseResumeBuffer):
+    """a capped list next to a version counter in the redis of `REDIS_URL`"""
+    KEY = 'game:updates:{}'
+    VERSION_KEY = 'game:updates:{}:version'
+    NEXT_VERSION_SCRIPT = """
+        local version = redis.call('INCR', KEYS[1])
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+        return version
+    """
+    APPEND_SCRIPT = """
+        redis.call('RPUSH', KEYS[1], ARGV[1])
+        redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        from mysite.redis_client import get_redis
+        self.redis = get_redis()
+        self._next_version_script = self.redis.register_script(self.NEXT_VERSION_SCRIPT)
+        self._append_script = self.redis.register_script(self.APPEND_SCRIPT)
+
+    def next_version(self, room_name):
+        return self._next_version_script(keys=[self.VERSION_KEY.format(room_name)], args=[self.ttl])
+
+    def append(self, room_name, version, room_data):
+        self._append_script(keys=[self.KEY.format(room_name)], args=[self._pack(version, room_data), self.size, self.ttl])
+
+    def version(self, room_name):
+        return int(self.redis.get(self.VERSION_KEY.format(room_name)) or 0)
+
+    def since(self, room_name, version):
+        pipeline = self.redis.pipeline()
+        pipeline.get(self.VERSION_KEY.format(room_name))
+        pipeline.lrange(self.KEY.format(room_name), 0, -1)
+        latest, entries = pipeline.execute()
+        latest = int(latest or 0)
+        return latest, self._after(version, latest, entries)
+
+    def delete(self, room_name):
+        self.redis.delete(self.KEY.format(room_name), self.VERSION_KEY.format(room_name))
+
+
+class InMemoryResumeBuffer(BaseResumeBuffer):
+    """single process stand-in"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._rooms = {}  # room_name to [version, deque of packed updates, expire_at]
+        self._lock = threading.Lock()
+
+    def next_version(self, room_name):
+        with self._lock:
+            room = self._get(room_name)
+            room[0] += 1
+            room[2] = time.monotonic() + self.ttl
+            return room[0]
+
+    def append(self, room_name, version, room_data):
+        data = self._pack(version, room_data)
+        with self._lock:
+            room = self._get(room_name)
+            room[1].append(data)
+            room[2] = time.monotonic() + self.ttl
+
+    def version(self, room_name):
+        with self._lock:
+            return self._get(room_name)[0]
+
+    def since(self, room_name, version):
+        with self._lock:
+            latest, entries, _ = self._get(room_name)
+            entries = list(entries)
+        return latest, self._after(version, latest, entries)
+
+    def delete(self, room_name):
+        with self._lock:
+            self._rooms.pop(room_name, None)
+
+    def _get(self, room_name):
+        room = self._rooms.get(room_name)
+        if room is None or room[2] < time.monotonic():
+            room = self._rooms[room_name] = [0, deque(maxlen=self.size), time.monotonic() + self.ttl]
+        return room
+
+
+_buffer = None
+
+
+def get_resume_buffer() -> BaseResumeBuffer:
+    global _buffer
+    if _buffer is None:
+        config = settings.GAME_RESUME_BUFFER
+        _buffer = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _buffer
@@ -0,0 +1,34 @@
+"""encode a room counter value into a short, non-sequential permanent_url
+
+values are mapped through an affine permutation of [0, 62 ** 6) before being
+written in base62, so two different counter values can never give the same
+id and consecutive rooms do not get look-alike urls
+"""
+
+ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+ROOM_ID_LENGTH = 6
+ROOM_ID_SPACE = len(ALPHABET) ** ROOM_ID_LENGTH
+
+# MULTIPLIER must stay coprime with ROOM_ID_SPACE (= 2^6 * 31^6) for the mapping to be a bijection
+MULTIPLIER = 14_868_502_753
+OFFSET = 20_210_528_417
+
+
+def encode_room_id(value: int) -> str:
+    """map a counter value to a `ROOM_ID_LENGTH` characters id
+
+    :parms
+        value: counter value, 0 <= value < ROOM_ID_SPACE (Int)
+
+    :returns
+        room id (Str)
+    """
+    if not 0 <= value < ROOM_ID_SPACE:
+        raise ValueError(f'room counter {value} out of range')
+
+    n = (value * MULTIPLIER + OFFSET) % ROOM_ID_SPACE
+    chars = []
+    for _ in range(ROOM_ID_LENGTH):
+        n, r = divmod(n, len(ALPHABET))
+        chars.append(ALPHABET[r])
+    return ''.join(reversed(chars))
@@ -1,9 +1,15 @@
 from django.urls import re_path, path
 
 from . import consumers
+from .sharding import ShardChannelRouter
 
 websocket_urlpatterns = [
     path('ws/lobby/', consumers.LobbyConsumer.as_asgi(), name='ws_lobby'),
+    path('ws/matchmaking/', consumers.MatchmakingConsumer.as_asgi(), name='ws_matchmaking'),
     path('ws/game/<str:room_name>/', consumers.GameRoomConsumer.as_asgi(), name='ws_room'),
+    path('ws/spectate/<str:room_name>/', consumers.SpectatorConsumer.as_asgi(), name='ws_spectate'),
     # re_path(r'ws/chat/(?P<room_name>\w+)/$', consumers.ChatConsumer.as_asgi()),
 ]
+
+# background channels read by `manage.py runshard`
+shard_application = ShardChannelRouter(consumers.GameShardConsumer.as_asgi())
@@ -1,6 +1,6 @@
-from rest_framework.serializers import ModelSerializer, SerializerMethodField, StringRelatedField
+from rest_framework.serializers import IntegerField, ModelSerializer, SerializerMethodField, StringRelatedField
 
-from .models import GameRoom, PlayerData
+from .models import GameRoom, PlayerData, PlayerSummary
 
 
 class PlayerDataSerializer(ModelSerializer):
@@ -13,11 +13,15 @@ class PlayerDataSerializer(ModelSerializer):
 
 class GameRoomSerializer(ModelSerializer):
     players_data = SerializerMethodField()
+    game_data = SerializerMethodField()
     admin = SerializerMethodField()
 
     def get_players_data(self, room: GameRoom):
         return PlayerDataSerializer(PlayerData.objects.all().filter(room=room), many=True).data
 
+    def get_game_data(self, room: GameRoom):
+        return room.get_game_data()
+
     def get_admin(self, room: GameRoom):
         return None if room.admin is None else room.admin.username
 
@@ -26,12 +30,18 @@ class GameRoomSerializer(ModelSerializer):
         fields = ['players_data', 'status', 'game_data', 'permanent_url', 'volume', 'admin']
 
 
-class LightGameRoomSerializer(GameRoomSerializer):
-    players_length = SerializerMethodField()
-
-    def get_players_length(self, permanent_url):
-        return len(PlayerData.objects.all().filter(room__permanent_url=permanent_url))
+class LightGameRoomSerializer(ModelSerializer):
+    # expects a queryset built with `GameRoom.objects.light()`
+    players_length = IntegerField(read_only=True)
 
     class Meta:
         model = GameRoom
         fields = ['players_length', 'status', 'permanent_url', 'volume']
+
+
+class PlayerSummarySerializer(ModelSerializer):
+    player = StringRelatedField()
+
+    class Meta:
+        model = PlayerSummary
+        fields = ['player', 'games_played', 'points', 'wins']
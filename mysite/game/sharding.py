@@ -0,0 +1,208 @@
+"""room affinity for the multi-worker mode
+
+Every live shard worker (`manage.py runshard`) heartbeats into a registry.
+Rooms are placed on the workers with a consistent hash ring over
+`permanent_url`, so when a worker joins or leaves only the rooms next to it
+on the ring change owner. Websocket consumers forward room events to the
+owner's channel and the owner is the only process writing that room.
+
+Room state is never held by a worker between events, so moving a room to
+another worker needs no hand-over: the new owner simply reads it on the
+next event. Turn deadlines expiring in another process are forwarded to the
+owner as well.
+
+Joining and leaving a room are exempt, they are applied by the socket's own
+process when it connects and disconnects. Both decide under the room's row
+lock and bump `version`, so a concurrent save of the owner fails its
+compare-and-swap and is retried on the new row.
+
+Registries must be shared by the web server and the workers, which are
+separate processes, `runshard` refuses to start on `InMemoryWorkerRegistry`.
+"""
+import bisect
+import hashlib
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+SHARD_CHANNEL_PREFIX = 'game-shard.'
+# a forwarded event is re-forwarded at most this many times while workers disagree on the ring
+MAX_HOPS = 2
+
+
+def shard_channel(worker_id: str) -> str:
+    return f'{SHARD_CHANNEL_PREFIX}{worker_id}'
+
+
+def worker_id_from_channel(channel: str) -> str:
+    return channel[len(SHARD_CHANNEL_PREFIX):]
+
+
+def clean_worker_id(worker_id: str) -> str:
+    """channel names only allow ascii letters, digits, hyphens, underscores and periods"""
+    return re.sub(r'[^\w.-]', '-', worker_id)[:64]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """consistent hash ring with `replicas` virtual nodes per worker"""
+
+    def __init__(self, nodes=(), replicas=100):
+        self.nodes = frozenset(nodes)
+        self._ring = sorted((_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(replicas))
+        self._keys = [key for key, _ in self._ring]
+
+    def get_node(self, key: str):
+        if not self._ring:
+            return None
+        idx = bisect.bisect(self._keys, _hash(key)) % len(self._ring)
+        return self._ring[idx][1]
+
+
+class BaseWorkerRegistry:
+    # seen by every process, a worker is only reachable through a shared registry
+    shared = True
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def heartbeat(self, worker_id: str):
+        raise NotImplementedError
+
+    def remove(self, worker_id: str):
+        raise NotImplementedError
+
+    def live_workers(self) -> list:
+        raise NotImplementedError
+
+
+class RedisWorkerRegistry(BaseWorkerRegistry):
+    """workers are kept in a sorted set scored by their last heartbeat"""
+    KEY = 'game:shard:workers'
+
+    def __init__(self, timeout):
+        super().__init__(timeout)
+        from mysite.redis_client import get_redis
+        self.redis = get_redis()
+
+    def heartbeat(self, worker_id):
+        self.redis.zadd(self.KEY, {worker_id: time.time()})
+
+    def remove(self, worker_id):
+        self.redis.zrem(self.KEY, worker_id)
+
+    def live_workers(self):
+        deadline = time.time() - self.timeout
+        self.redis.zremrangebyscore(self.KEY, '-inf', deadline)
+        return [worker_id.decode('utf-8') for worker_id in self.redis.zrange(self.KEY, 0, -1)]
+
+
+class InMemoryWorkerRegistry(BaseWorkerRegistry):
+    """single process stand-in, for tests driving routers and workers within one process"""
+    shared = False
+
+    def __init__(self, timeout):
+        super().__init__(timeout)
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def heartbeat(self, worker_id):
+        with self._lock:
+            self._workers[worker_id] = time.monotonic()
+
+    def remove(self, worker_id):
+        with self._lock:
+            self._workers.pop(worker_id, None)
+
+    def live_workers(self):
+        deadline = time.monotonic() - self.timeout
+        with self._lock:
+            return [worker_id for worker_id, seen in self._workers.items() if seen >= deadline]
+
+
+class ShardRouter:
+    """answers which worker owns a room, the ring is rebuilt at most once per `refresh_interval`"""
+
+    def __init__(self, registry, refresh_interval=1.0):
+        self.registry = registry
+        self.refresh_interval = refresh_interval
+        self._ring = HashRing()
+        self._expire_at = 0
+        self._lock = threading.Lock()
+        # worker ids served by this process, set by `runshard`
+        self.local_workers = frozenset()
+
+    def owner(self, room_name: str):
+        """worker id owning `room_name`, None when no worker is alive"""
+        return self.ring().get_node(room_name)
+
+    def remote_owner(self, room_name: str):
+        """worker id owning `room_name`, None when no worker is alive or this process is the owner"""
+        owner = self.owner(room_name)
+        return None if owner in self.local_workers else owner
+
+    def ring(self) -> HashRing:
+        if time.monotonic() >= self._expire_at:
+            with self._lock:
+                if time.monotonic() >= self._expire_at:
+                    workers = self.registry.live_workers()
+                    if frozenset(workers) != self._ring.nodes:
+                        self._ring = HashRing(workers)
+                    self._expire_at = time.monotonic() + self.refresh_interval
+        return self._ring
+
+
+class ShardHeartbeat(threading.Thread):
+    """keeps `worker_ids` registered while the worker process runs"""
+
+    def __init__(self, registry, worker_ids, interval):
+        super().__init__(name='shard-heartbeat', daemon=True)
+        self.registry = registry
+        self.worker_ids = worker_ids
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            for worker_id in self.worker_ids:
+                self.registry.heartbeat(worker_id)
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        # leave the ring right away instead of waiting for the timeout
+        for worker_id in self.worker_ids:
+            self.registry.remove(worker_id)
+
+
+class ShardChannelRouter:
+    """ASGI `channel` protocol router sending every shard channel to one consumer"""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if not scope['channel'].startswith(SHARD_CHANNEL_PREFIX):
+            raise ValueError(f'No route found for channel {scope["channel"]!r}')
+        return await self.application(scope, receive, send)
+
+
+_router = None
+
+
+def get_shard_router():
+    """the process' `ShardRouter`, None when the multi-worker mode is disabled"""
+    global _router
+    config = settings.GAME_SHARDING
+    if not config['ENABLED']:
+        return None
+    if _router is None:
+        registry = import_string(config['REGISTRY'])(timeout=config['WORKER_TIMEOUT'])
+        _router = ShardRouter(registry)
+    return _router
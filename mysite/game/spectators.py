@@ -0,0 +1,234 @@
+"""spectators of a room, fed from one shared feed per room and process
+
+The spectator sockets of a process never join the room group themselves.
+The process' `SpectatorHub` keeps one `RoomFeed` per watched room, which joins
+the room group with a single channel and only notes that the room changed.
+At most `SPECTATORS['MAX_UPDATES_PER_SECOND']` times a second the feed builds
+the public projection of the last room data broadcast to the group, reading
+the room only when there was none, encodes it once per frame encoding in use
+and hands the same frame to every spectator. So the players'
+moves cost nothing more, whatever the number of spectators.
+
+The projection leaves out everything a player could not see on the table:
+hands, roles, the draw pile, the gold position, unrevealed goal cards and
+personal messages.
+"""
+import asyncio
+import logging
+import time
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .frames import encode
+from .models import GameRoom, PlayerData
+
+logger = logging.getLogger(__name__)
+
+# goal cards are `70 + n` until a road reaches them
+HIDDEN_GOAL = 70
+
+
+def public_game_data(game_data: dict) -> dict:
+    """the part of a `GameController.to_dict()` output every spectator may see"""
+    if not game_data:
+        return {}
+    board = [
+        [
+            {**card, 'card_no': HIDDEN_GOAL} if card['card_no'] > HIDDEN_GOAL else card
+            for card in row
+        ]
+        for row in game_data['board']
+    ]
+    players = [
+        {
+            'id': player['id'],
+            'point': player['point'],
+            'action_state': player['action_state'],
+            'hand_size': len(player['hand_cards']),
+        }
+        for player in game_data['player_list']
+    ]
+    # peeks and illegal plays are told to one player only, everyone is told the rest
+    message = next((msg for msg in game_data['return_msg'] if msg.get('msg_type') == 'INFO'), None)
+    return {
+        'round': game_data['round'],
+        'num_player': game_data['num_player'],
+        'player_list': players,
+        'game_state': game_data['game_state'],
+        'turn': game_data['turn'],
+        'now_play': game_data['now_play'],
+        'board': board,
+        'card_pool_size': len(game_data['card_pool']),
+        'fold_deck_size': len(game_data['fold_deck']),
+        'gold_stack_size': len(game_data['gold_stack']),
+        'message': message,
+    }
+
+
+def public_room(room_data: dict) -> dict:
+    """the spectators' `room_data` projected from a `GameRoomSerializer` output"""
+    return {
+        'permanent_url': room_data['permanent_url'],
+        'status': room_data['status'],
+        'volume': room_data['volume'],
+        'players_data': [
+            {'player': player_data['player'], 'point': player_data['point']}
+            for player_data in room_data['players_data']
+        ],
+        'game_data': public_game_data(room_data['game_data']),
+    }
+
+
+def load_public_room(room_name):
+    """the spectators' `room_data` of `room_name`, None if the room is gone"""
+    room = GameRoom.objects.filter(permanent_url=room_name).first()
+    if room is None:
+        return None
+    return {
+        'permanent_url': room.permanent_url,
+        'status': room.status,
+        'volume': room.volume,
+        'players_data': [
+            {'player': username, 'point': point}
+            for username, point in PlayerData.objects.filter(room=room).order_by('pk')
+            .values_list('player__username', 'point')
+        ],
+        'game_data': public_game_data(room.get_game_data()),
+    }
+
+
+class RoomFeed:
+    """the spectators of one room in this process
+
+    :parms
+        room_name: the room's permanent_url (Str)
+        interval: least seconds between two frames (Float)
+    """
+
+    def __init__(self, room_name, interval):
+        self.room_name = room_name
+        self.interval = interval
+        self.spectators = set()
+        self.frames = {}  # encoding to (text_data, bytes_data) of the last room data
+        self.room_data = None
+        self._broadcast = None  # room data of the last update received, None to read the room
+        self._dirty = False
+        self._last_flush = 0
+        self._flush_task = None
+        self._receive_task = None
+        self._channel_name = None
+        self._group_name = GameRoom(permanent_url=room_name).room_group_name()
+
+    async def start(self):
+        channel_layer = get_channel_layer()
+        self._channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(self._group_name, self._channel_name)
+        self._receive_task = asyncio.ensure_future(self._receive())
+        self.mark_dirty()
+
+    async def stop(self):
+        for task in (self._receive_task, self._flush_task):
+            if task is not None:
+                task.cancel()
+        await get_channel_layer().group_discard(self._group_name, self._channel_name)
+
+    async def add(self, spectator):
+        self.spectators.add(spectator)
+        if self.room_data is not None:
+            await self._send(spectator)
+
+    def mark_dirty(self):
+        self._dirty = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_soon())
+
+    async def _receive(self):
+        channel_layer = get_channel_layer()
+        while True:
+            message = await channel_layer.receive(self._channel_name)
+            # kicks, alerts and the like are of no interest to spectators
+            if message.get('type') == 'update_room':
+                self._broadcast = message.get('room_data')
+                self.mark_dirty()
+
+    async def _flush_soon(self):
+        while self._dirty:
+            delay = self._last_flush + self.interval - time.monotonic()
+            if delay > 0:
+                # every change until then is sent with the same frame
+                await asyncio.sleep(delay)
+            self._dirty = False
+            self._last_flush = time.monotonic()
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception('Spectator update of %s failed', self.room_name)
+
+    async def _flush(self):
+        broadcast, self._broadcast = self._broadcast, None
+        if broadcast is not None:
+            # serialized by the sender already, nothing to read
+            room_data = public_room(broadcast)
+        else:
+            # not on the thread the players' sync consumers share
+            room_data = await database_sync_to_async(load_public_room, thread_sensitive=False)(self.room_name)
+        if room_data is None:
+            for spectator in list(self.spectators):
+                await spectator.close(code=4004)
+            return
+        self.room_data, self.frames = room_data, {}
+        for spectator in list(self.spectators):
+            await self._send(spectator)
+
+    async def _send(self, spectator):
+        frame = self.frames.get(spectator.encoding)
+        if frame is None:
+            frame = self.frames[spectator.encoding] = encode(
+                {'event': 'spectator_room_updated', 'room_data': self.room_data}, spectator.encoding
+            )
+        text_data, bytes_data = frame
+        try:
+            await spectator.send(text_data=text_data, bytes_data=bytes_data)
+        except Exception:
+            # a socket closing meanwhile must not hold up the others
+            logger.debug('Dropped a spectator frame of %s', self.room_name, exc_info=True)
+
+
+class SpectatorHub:
+    """the process' feeds, lives on the event loop of the ASGI server"""
+
+    def __init__(self, max_updates_per_second):
+        self.interval = 1 / max_updates_per_second
+        self.feeds = {}
+        self._lock = asyncio.Lock()
+
+    async def watch(self, room_name, spectator):
+        async with self._lock:
+            feed = self.feeds.get(room_name)
+            if feed is None:
+                feed = self.feeds[room_name] = RoomFeed(room_name, self.interval)
+                await feed.start()
+        await feed.add(spectator)
+
+    async def unwatch(self, room_name, spectator):
+        async with self._lock:
+            feed = self.feeds.get(room_name)
+            if feed is None:
+                return
+            feed.spectators.discard(spectator)
+            if not feed.spectators:
+                del self.feeds[room_name]
+                await feed.stop()
+
+
+_hub = None
+
+
+def get_spectator_hub() -> SpectatorHub:
+    global _hub
+    loop = asyncio.get_running_loop()
+    if _hub is None or _hub[0] is not loop:
+        _hub = loop, SpectatorHub(settings.SPECTATORS['MAX_UPDATES_PER_SECOND'])
+    return _hub[1]
@@ -0,0 +1,213 @@
+"""hot storage for the `GameController` state of rooms being played
+
+Moves only update the hot store. `GameRoom.game_data` in the database is
+written as a checkpoint when a game starts, at every round boundary and at
+game end, so the database load follows completed rounds instead of moves.
+After a restart the hot state is read back from redis, or from the last
+checkpoint when redis lost it.
+
+Every stored state carries a sequence number and writes are compare-and-set
+on it, so two processes applying a move to the same state cannot both win.
+The move that produced a state is appended to the room's move log by the same
+write, the log is moved into `RoundLog` rows at round boundaries.
+"""
+import threading
+import time
+import zlib
+
+import msgpack
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def pack_state(state: dict, level=1) -> bytes:
+    return zlib.compress(msgpack.packb(state, use_bin_type=True), level)
+
+
+def unpack_state(data: bytes) -> dict:
+    return msgpack.unpackb(zlib.decompress(data), raw=False)
+
+
+class StaleStateError(Exception):
+    """the stored state changed since it was loaded"""
+
+
+class BaseStateStore:
+    def __init__(self, ttl):
+        # states of rooms nobody plays anymore eventually expire
+        self.ttl = ttl
+
+    def load(self, room_name: str):
+        """the stored `(seq, state)` of `room_name`, None if there is none"""
+        raise NotImplementedError
+
+    def seq(self, room_name: str):
+        """the stored sequence number of `room_name` without reading the state, None if there is none"""
+        raise NotImplementedError
+
+    def save(self, room_name: str, state: dict, expected_seq=None, move=None) -> int:
+        """store `state` if the stored sequence number still is `expected_seq`
+
+        :parms
+            room_name: the room's permanent_url (Str)
+            state: `GameController.to_dict()` output (Dict)
+            expected_seq: seq returned by `load`, None to only create a missing state (Int)
+            move: appended to the move log together with the state (List)
+
+        :returns
+            the sequence number of the new state (Int)
+
+        :raises
+            StaleStateError: another write happened in between
+        """
+        raise NotImplementedError
+
+    def moves(self, room_name: str, up_to_seq=None) -> list:
+        """the logged moves of `room_name` in order, up to the one which produced `up_to_seq`"""
+        raise NotImplementedError
+
+    def trim_moves(self, room_name: str, count: int):
+        """drop the first `count` logged moves once they are stored elsewhere"""
+        raise NotImplementedError
+
+    def delete(self, room_name: str):
+        """drop the state and the move log of `room_name`"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _pack_move(seq, move):
+        return msgpack.packb([seq, *move], use_bin_type=True)
+
+    @staticmethod
+    def _unpack_moves(entries, up_to_seq):
+        moves = []
+        for entry in entries:
+            seq, *move = msgpack.unpackb(entry, raw=False)
+            if up_to_seq is not None and seq > up_to_seq:
+                break
+            moves.append(move)
+        return moves
+
+
+class RedisStateStore(BaseStateStore):
+    """states are stored as zlib compressed msgpack in a hash of the redis of `REDIS_URL`
+
+    the hash holds `seq` and `data`, the compare-and-set runs as a lua script
+    which also pushes the move onto the room's move log list
+    """
+    KEY = 'game:state:{}'
+    MOVES_KEY = 'game:moves:{}'
+    SAVE_SCRIPT = """
+        local seq = redis.call('HGET', KEYS[1], 'seq')
+        if (seq or '') ~= ARGV[1] then
+            return -1
+        end
+        redis.call('HSET', KEYS[1], 'seq', ARGV[2], 'data', ARGV[3])
+        redis.call('EXPIRE', KEYS[1], ARGV[4])
+        if ARGV[5] ~= '' then
+            redis.call('RPUSH', KEYS[2], ARGV[5])
+            redis.call('EXPIRE', KEYS[2], ARGV[4])
+        end
+        return tonumber(ARGV[2])
+    """
+
+    def __init__(self, ttl):
+        super().__init__(ttl)
+        from mysite.redis_client import get_redis
+        self.redis = get_redis()
+        self._save_script = self.redis.register_script(self.SAVE_SCRIPT)
+
+    def load(self, room_name):
+        seq, data = self.redis.hmget(self.KEY.format(room_name), 'seq', 'data')
+        return None if data is None else (int(seq), unpack_state(data))
+
+    def seq(self, room_name):
+        seq = self.redis.hget(self.KEY.format(room_name), 'seq')
+        return None if seq is None else int(seq)
+
+    def save(self, room_name, state, expected_seq=None, move=None):
+        new_seq = 0 if expected_seq is None else expected_seq + 1
+        result = self._save_script(
+            keys=[self.KEY.format(room_name), self.MOVES_KEY.format(room_name)],
+            args=[
+                '' if expected_seq is None else expected_seq, new_seq, pack_state(state), self.ttl,
+                b'' if move is None else self._pack_move(new_seq, move),
+            ]
+        )
+        if result < 0:
+            raise StaleStateError(room_name)
+        return new_seq
+
+    def moves(self, room_name, up_to_seq=None):
+        return self._unpack_moves(self.redis.lrange(self.MOVES_KEY.format(room_name), 0, -1), up_to_seq)
+
+    def trim_moves(self, room_name, count):
+        # moves are only ever appended, so the first `count` are still the ones read
+        self.redis.ltrim(self.MOVES_KEY.format(room_name), count, -1)
+
+    def delete(self, room_name):
+        self.redis.delete(self.KEY.format(room_name), self.MOVES_KEY.format(room_name))
+
+
+class InMemoryStateStore(BaseStateStore):
+    """single process stand-in, states are packed the same way as in redis"""
+
+    def __init__(self, ttl):
+        super().__init__(ttl)
+        self._states = {}
+        self._moves = {}
+        self._lock = threading.Lock()
+
+    def load(self, room_name):
+        with self._lock:
+            seq, data = self._get(room_name)
+        return None if data is None else (seq, unpack_state(data))
+
+    def seq(self, room_name):
+        with self._lock:
+            return self._get(room_name)[0]
+
+    def save(self, room_name, state, expected_seq=None, move=None):
+        data = pack_state(state)
+        with self._lock:
+            seq, _ = self._get(room_name)
+            if seq != expected_seq:
+                raise StaleStateError(room_name)
+            new_seq = 0 if expected_seq is None else expected_seq + 1
+            self._states[room_name] = (new_seq, data, time.monotonic() + self.ttl)
+            if move is not None:
+                self._moves.setdefault(room_name, []).append(self._pack_move(new_seq, move))
+        return new_seq
+
+    def moves(self, room_name, up_to_seq=None):
+        with self._lock:
+            entries = list(self._moves.get(room_name, ()))
+        return self._unpack_moves(entries, up_to_seq)
+
+    def trim_moves(self, room_name, count):
+        with self._lock:
+            entries = self._moves.get(room_name)
+            if entries is not None:
+                del entries[:count]
+
+    def delete(self, room_name):
+        with self._lock:
+            self._states.pop(room_name, None)
+            self._moves.pop(room_name, None)
+
+    def _get(self, room_name):
+        seq, data, expire_at = self._states.get(room_name, (None, None, 0))
+        if expire_at < time.monotonic():
+            return None, None
+        return seq, data
+
+
+_store = None
+
+
+def get_state_store() -> BaseStateStore:
+    global _store
+    if _store is None:
+        config = settings.GAME_STATE_STORE
+        _store = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _store
@@ -0,0 +1,31 @@
+"""streamed responses read from the database, served through ASGI
+
+Under ASGI, Django collects a synchronous iterator handed to
+`StreamingHttpResponse` into a list before sending the first byte.
+`in_thread` wraps it into an asynchronous iterator instead. Every chunk is
+produced by the synchronous iterator through `sync_to_async`, on the
+request's own sync thread, so a server-side cursor keeps its connection, the
+event loop never runs a query and memory stays bounded by one chunk.
+"""
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+LINES_PER_CHUNK = 100
+
+
+async def in_thread(lines, lines_per_chunk=LINES_PER_CHUNK):
+    """yield the lines of the synchronous iterable `lines`, joined `lines_per_chunk` at a time"""
+    iterator = iter(lines)
+    next_chunk = sync_to_async(lambda: ''.join(islice(iterator, lines_per_chunk)), thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_chunk()
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        # a client leaving early must not leave the cursor open
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=True)()
@@ -0,0 +1,203 @@
+"""garbage collection of the `GameRoom` table
+
+- organizing rooms nobody touched for `ORGANIZE_TTL` are deleted, their
+  sockets are long gone (a crashed server never ran `leave_room`); every
+  process touches the rooms its game sockets are connected to every
+  `PRESENCE_INTERVAL`, so an idle lobby is kept while anybody waits in it
+- playing rooms without live state nor checkpoint for `PLAYING_TTL` are
+  ended, no points are recorded for an abandoned game
+- the `game_data` of rooms finished for `ARCHIVE_AFTER` is moved into a
+  compressed `GameArchive` row, leaving a slim room row behind
+
+Every step works in batches and only acts on rows still matching its
+condition, so several sweepers may run at once.
+
+Run it with `manage.py sweeprooms`, or in the ASGI process with
+`ROOM_SWEEPER['IN_PROCESS']`.
+"""
+import logging
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import GameArchive, GameRoom
+from .state_store import get_state_store
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_rooms(config=None, now=None) -> dict:
+    """run every step once
+
+    :returns
+        number of rooms handled per step (Dict)
+    """
+    config = config or settings.ROOM_SWEEPER
+    now = now or timezone.now()
+    return {
+        'expired': expire_organizing_rooms(now - timedelta(seconds=config['ORGANIZE_TTL']), config['BATCH_SIZE']),
+        'abandoned': end_abandoned_games(now - timedelta(seconds=config['PLAYING_TTL']), config['BATCH_SIZE']),
+        'archived': archive_finished_games(now - timedelta(seconds=config['ARCHIVE_AFTER']), config['BATCH_SIZE']),
+    }
+
+
+def _stale_rooms(status, before, batch_size, after_pk):
+    return list(
+        GameRoom.objects.filter(status=status, updated_at__lt=before, pk__gt=after_pk)
+        .order_by('pk').only('id', 'status', 'permanent_url')[:batch_size]
+    )
+
+
+def expire_organizing_rooms(before, batch_size) -> int:
+    count, after_pk = 0, 0
+    while True:
+        rooms = _stale_rooms(GameRoom.StatusType.ORGANIZE, before, batch_size, after_pk)
+        if not rooms:
+            return count
+        after_pk = rooms[-1].pk
+        for room in rooms:
+            # a join may have touched the room since it was listed
+            if GameRoom.objects.filter(pk=room.pk, status=GameRoom.StatusType.ORGANIZE,
+                                       updated_at__lt=before).delete()[0]:
+                room._send_delete_to_lobby()
+                room.forget()
+                count += 1
+
+
+def end_abandoned_games(before, batch_size) -> int:
+    store = get_state_store()
+    count, after_pk = 0, 0
+    while True:
+        rooms = _stale_rooms(GameRoom.StatusType.PLAYING, before, batch_size, after_pk)
+        if not rooms:
+            return count
+        after_pk = rooms[-1].pk
+        for room in rooms:
+            if store.seq(room.permanent_url) is not None:
+                # still played, moves only reach the table at round boundaries
+                continue
+            if GameRoom.objects.filter(pk=room.pk, status=GameRoom.StatusType.PLAYING, updated_at__lt=before) \
+                    .bump_version(status=GameRoom.StatusType.END):
+                room.status = GameRoom.StatusType.END
+                room._send_update_to_game_room()
+                count += 1
+
+
+def archive_finished_games(before, batch_size) -> int:
+    count = 0
+    while True:
+        # archived rows drop out of the filter, no cursor needed
+        rooms = list(
+            GameRoom.objects.filter(status=GameRoom.StatusType.END, updated_at__lt=before)
+            .exclude(game_data={}).order_by('pk').values_list('pk', 'game_data')[:batch_size]
+        )
+        if not rooms:
+            return count
+        with transaction.atomic():
+            GameArchive.objects.bulk_create(
+                [GameArchive.from_game_data(pk, game_data) for pk, game_data in rooms],
+                ignore_conflicts=True
+            )
+            # the content does not change, so neither does the room version
+            GameRoom.objects.filter(pk__in=[pk for pk, _ in rooms]).update(game_data={})
+        count += len(rooms)
+
+
+class RoomSweeper(threading.Thread):
+    """runs `sweep_rooms` every `interval` seconds until stopped"""
+
+    def __init__(self, interval):
+        super().__init__(name='room-sweeper', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                counts = sweep_rooms()
+                if any(counts.values()):
+                    logger.info('Swept rooms %s', counts)
+            except Exception:
+                logger.exception('Room sweep failed')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class RoomPresence(threading.Thread):
+    """touches the organizing rooms this process has game sockets in, every `interval` seconds
+
+    only `updated_at` is set, the version and so the rooms' ETags stay the same
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='room-presence', daemon=True)
+        self.interval = interval
+        self._sockets = Counter()  # room pk to open game sockets
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def connected(self, room_pk):
+        with self._lock:
+            self._sockets[room_pk] += 1
+
+    def disconnected(self, room_pk):
+        with self._lock:
+            self._sockets[room_pk] -= 1
+            if self._sockets[room_pk] <= 0:
+                del self._sockets[room_pk]
+
+    def touch(self) -> int:
+        with self._lock:
+            room_pks = list(self._sockets)
+        if not room_pks:
+            return 0
+        return GameRoom.objects.filter(pk__in=room_pks, status=GameRoom.StatusType.ORGANIZE) \
+            .update(updated_at=timezone.now())
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.touch()
+            except Exception:
+                logger.exception('Room presence update failed')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+
+_presence = None
+_presence_lock = threading.Lock()
+
+
+def get_room_presence() -> RoomPresence:
+    """the process' presence, its thread is started on first use"""
+    global _presence
+    if _presence is None:
+        with _presence_lock:
+            if _presence is None:
+                presence = RoomPresence(settings.ROOM_SWEEPER['PRESENCE_INTERVAL'])
+                presence.start()
+                _presence = presence
+    return _presence
+
+
+_sweeper = None
+
+
+def start_in_process_sweeper():
+    """start the process' sweeper thread when `ROOM_SWEEPER['IN_PROCESS']` is set"""
+    global _sweeper
+    config = settings.ROOM_SWEEPER
+    if config['IN_PROCESS'] and _sweeper is None:
+        _sweeper = RoomSweeper(config['INTERVAL'])
+        _sweeper.start()
+    return _sweeper
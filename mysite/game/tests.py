@@ -1,3 +1,40 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from .turn_timers import TimingWheel
+
+
+class TimingWheelTests(SimpleTestCase):
+    def test_fires_at_deadline(self):
+        wheel = TimingWheel(tick=1, slots=4, levels=2, now=0)
+        wheel.schedule('room', 6)
+
+        self.assertEqual(wheel.advance(5), [])
+        self.assertEqual([timer.key for timer in wheel.advance(6)], ['room'])
+        self.assertNotIn('room', wheel)
+
+    def test_deadline_beyond_single_level(self):
+        wheel = TimingWheel(tick=1, slots=4, levels=1, now=0)
+        wheel.schedule('room', 10)
+
+        for now in range(10):
+            self.assertEqual(wheel.advance(now), [], f'fired at {now}')
+        self.assertIn('room', wheel)
+        self.assertEqual([timer.key for timer in wheel.advance(10)], ['room'])
+
+    def test_deadline_beyond_all_levels(self):
+        wheel = TimingWheel(tick=1, slots=4, levels=2, now=0)
+        wheel.schedule('room', 40)
+
+        self.assertEqual(wheel.advance(39), [])
+        self.assertEqual([timer.key for timer in wheel.advance(40)], ['room'])
+
+    def test_reschedule_and_cancel(self):
+        wheel = TimingWheel(tick=1, slots=4, levels=2, now=0)
+        wheel.schedule('moved', 3)
+        wheel.schedule('moved', 9)
+        wheel.schedule('cancelled', 2)
+
+        self.assertTrue(wheel.cancel('cancelled'))
+        self.assertEqual(wheel.advance(8), [])
+        self.assertEqual([timer.key for timer in wheel.advance(9)], ['moved'])
+        self.assertEqual(len(wheel), 0)
@@ -0,0 +1,288 @@
+"""turn deadlines of the playing rooms
+
+A player has `TURN_TIMER['TIMEOUT']` seconds for a move. When the deadline
+passes, the first card of their hand is folded for them, so an idle player
+does not hold the game, its sockets and its live state forever.
+
+Every process keeps the deadlines of the rooms it handled the last move of
+in one hierarchical timing wheel, driven by a single thread. Scheduling,
+rescheduling and cancelling are O(1), and the thread only wakes once a tick
+while deadlines are pending, whatever their number, and not at all while
+there are none.
+
+A deadline names the player and the `(round, turn)` it was set for. A stale
+deadline, left in another process after the game moved on there, folds
+nothing. Deadlines are not persisted: a socket connecting to a playing room
+sets one when its process has none, so a restart does not stall a game. In
+the multi-worker mode the fold is forwarded to the room's shard owner.
+"""
+import logging
+import math
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics
+from .sharding import get_shard_router, shard_channel
+
+logger = logging.getLogger(__name__)
+
+
+class _Timer:
+    __slots__ = ('key', 'deadline', 'payload', 'expires', 'level', 'slot')
+
+    def __init__(self, key, deadline, payload, expires):
+        self.key = key
+        self.deadline = deadline
+        self.payload = payload
+        self.expires = expires  # tick the timer fires at
+        self.level = self.slot = None
+
+
+class TimingWheel:
+    """hierarchical timing wheel, not thread safe
+
+    Level `n` has `slots` slots of `slots ** n` ticks each. A timer is kept in
+    the lowest level spanning its deadline and moves down a level whenever
+    the wheel reaches its slot, until it fires from the first level. Deadlines
+    further than `tick * slots ** levels` seconds ahead wait in the last level
+    and are placed again when it comes around.
+
+    :parms
+        tick: seconds per slot of the first level, the resolution (Float)
+        slots: slots per level (Int)
+        levels: number of levels (Int)
+        now: `time.monotonic()` value the ticks count from (Float)
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=3, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._origin = time.monotonic() if now is None else now
+        self._current = 0  # last tick processed
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]  # key to _Timer per slot
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def schedule(self, key, deadline: float, payload=None):
+        """fire `key` at `deadline` (a `time.monotonic()` value), replacing its previous deadline"""
+        self.cancel(key)
+        expires = max(self._current + 1, math.ceil((deadline - self._origin) / self.tick))
+        timer = self._timers[key] = _Timer(key, deadline, payload, expires)
+        self._place(timer)
+
+    def cancel(self, key) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        del self._wheels[timer.level][timer.slot][key]
+        return True
+
+    def next_tick_at(self) -> float:
+        """when the next tick is due"""
+        return self._origin + (self._current + 1) * self.tick
+
+    def advance(self, now: float) -> list:
+        """process the ticks up to `now`
+
+        :returns
+            the expired timers, `key`, `deadline` and `payload` are set (List[_Timer])
+        """
+        target = math.floor((now - self._origin) / self.tick)
+        if not self._timers:
+            # nothing to move down nor fire, the ticks can be skipped
+            self._current = max(self._current, target)
+            return []
+
+        expired = []
+        while self._current < target:
+            self._current += 1
+            span = self.slots ** (self.levels - 1)
+            for level in range(self.levels - 1, 0, -1):
+                if self._current % span == 0:
+                    self._cascade(level, (self._current // span) % self.slots)
+                span //= self.slots
+            slot = self._wheels[0][self._current % self.slots]
+            if slot:
+                self._wheels[0][self._current % self.slots] = {}
+                for timer in slot.values():
+                    if timer.expires > self._current:
+                        # beyond the wheel's span when placed, it goes round once more
+                        self._place(timer)
+                    else:
+                        del self._timers[timer.key]
+                        expired.append(timer)
+        return expired
+
+    def _cascade(self, level, index):
+        slot = self._wheels[level][index]
+        if slot:
+            self._wheels[level][index] = {}
+            for timer in slot.values():
+                self._place(timer)
+
+    def _place(self, timer):
+        expires = min(timer.expires, self._current + self.slots ** self.levels - 1)
+        delta = expires - self._current
+        level, span = 0, 1
+        while level < self.levels - 1 and delta >= span * self.slots:
+            level += 1
+            span *= self.slots
+        timer.level, timer.slot = level, (expires // span) % self.slots
+        self._wheels[level][timer.slot][timer.key] = timer
+
+
+class TurnTimer(threading.Thread):
+    """calls `expire(key, deadline, payload)` for every deadline of its wheel passed, until stopped
+
+    :parms
+        wheel: the deadlines (TimingWheel)
+        timeout: seconds from `start_turn` to the deadline (Float)
+        expire: called on this thread, outside the lock (Callable)
+    """
+
+    def __init__(self, wheel, timeout, expire):
+        super().__init__(name='turn-timer', daemon=True)
+        self.wheel = wheel
+        self.timeout = timeout
+        self.expire = expire
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def __contains__(self, key):
+        with self._condition:
+            return key in self.wheel
+
+    def __len__(self):
+        with self._condition:
+            return len(self.wheel)
+
+    def schedule(self, key, deadline, payload=None):
+        with self._condition:
+            idle = not self.wheel
+            self.wheel.schedule(key, deadline, payload)
+            if idle:
+                self._condition.notify()
+
+    def start_turn(self, key, payload=None):
+        self.schedule(key, time.monotonic() + self.timeout, payload)
+
+    def cancel(self, key):
+        with self._condition:
+            self.wheel.cancel(key)
+
+    def run(self):
+        while True:
+            with self._condition:
+                if self.wheel:
+                    self._condition.wait(max(0, self.wheel.next_tick_at() - time.monotonic()))
+                elif not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                expired = self.wheel.advance(time.monotonic())
+            if expired:
+                self._fire(expired)
+
+    def _fire(self, expired):
+        for timer in expired:
+            metrics.turn_timer_lag_seconds.observe(max(0, time.monotonic() - timer.deadline))
+            try:
+                self.expire(timer.key, timer.deadline, timer.payload)
+            except Exception:
+                logger.exception('Expiring the turn of %s failed', timer.key)
+        close_old_connections()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+
+def fold_expired_turn(room_name, deadline, turn):
+    """`fold_turn` on the room's shard owner, which is the only process writing it"""
+    router = get_shard_router()
+    owner = None if router is None else router.remote_owner(room_name)
+    if owner is None:
+        fold_turn(room_name, turn)
+        return
+    async_to_sync(get_channel_layer().send)(shard_channel(owner), {
+        'type': 'expire_turn',
+        'room_name': room_name,
+        'turn': list(turn),
+        'hops': 0,
+    })
+
+
+def fold_turn(room_name, turn):
+    """fold the first hand card of the player whose `turn` passed, unless they moved meanwhile
+
+    :parms
+        turn: `(player, round, turn)` the deadline was set for (Tuple)
+    """
+    from .models import GameRoom
+
+    player, round_, turn_ = turn
+    room = GameRoom.objects.filter(permanent_url=room_name, status=GameRoom.StatusType.PLAYING).first()
+    if room is None:
+        return
+    game_data = room.get_game_data()
+    if (game_data['now_play'], game_data['round'], game_data['turn']) != (player, round_, turn_):
+        return
+    hand_cards = next(data['hand_cards'] for data in game_data['player_list'] if data['id'] == player)
+    if not hand_cards:
+        return
+    room.state_control(hand_cards[0]['card_no'], -1, 0, -1, player=player, turn=(round_, turn_))
+    metrics.expired_turns.inc()
+
+
+_timer = None
+_timer_lock = threading.Lock()
+
+
+def get_turn_timer():
+    """the process' turn timer, started on first use, None when `TURN_TIMER['ENABLED']` is off"""
+    global _timer
+    config = settings.TURN_TIMER
+    if not config['ENABLED']:
+        return None
+    if _timer is None:
+        with _timer_lock:
+            if _timer is None:
+                wheel = TimingWheel(config['TICK'], config['SLOTS'], config['LEVELS'])
+                timer = TurnTimer(wheel, config['TIMEOUT'], fold_expired_turn)
+                timer.start()
+                _timer = timer
+    return _timer
+
+
+def start_turn(room_name, game_data):
+    """set the deadline of the turn `game_data` is at"""
+    timer = get_turn_timer()
+    if timer is not None:
+        timer.start_turn(room_name, (game_data['now_play'], game_data['round'], game_data['turn']))
+
+
+def cancel_turn(room_name):
+    timer = get_turn_timer()
+    if timer is not None:
+        timer.cancel(room_name)
+
+
+def ensure_turn(room):
+    """set a deadline for the playing `room` unless this process has one already"""
+    timer = get_turn_timer()
+    if timer is not None and room.permanent_url not in timer:
+        game_data = room.get_game_data()
+        if game_data:
+            start_turn(room.permanent_url, game_data)
@@ -7,5 +7,10 @@ urlpatterns = [
     path('room_create/', views.GameRoomCreate.as_view(), name='create'),
     path('room_list/', views.GameRoomList.as_view(), name='list'),
     path('history/', views.SelfGameRoomHistoryList.as_view(), name='history'),
+    path('history/export/', views.SelfGameRoomHistoryExport.as_view(), name='history_export'),
+    path('summary/', views.SelfPlayerSummaryDetail.as_view(), name='summary'),
+    path('leaderboard/', views.LeaderboardTop.as_view(), name='leaderboard'),
+    path('leaderboard/me/', views.SelfLeaderboardRank.as_view(), name='leaderboard_rank'),
+    path('<str:room_name>/replay/', views.GameRoomReplay.as_view(), name='replay'),
     path('<str:room_name>/', views.GameRoomDetail.as_view(), name='room'),
 ]
@@ -1,7 +1,41 @@
+import hashlib
+import json
+from datetime import datetime, time
+
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from rest_framework import permissions
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import ListAPIView, RetrieveAPIView, CreateAPIView
-from .serializers import GameRoomSerializer, LightGameRoomSerializer
-from .models import GameRoom
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import export
+from .leaderboard import BOARDS, get_leaderboard
+from .pagination import RoomCursorPagination
+from .replay import replay_events
+from .streaming import in_thread
+from .serializers import GameRoomSerializer, LightGameRoomSerializer, PlayerSummarySerializer
+from .models import GameRoom, PlayerData, PlayerSummary, RoundLog
+
+
+# browsers keep the response but revalidate it with If-None-Match on every request
+revalidate = cache_control(private=True, no_cache=True)
+
+
+def room_etag(request, room_name):
+    return GameRoom.etag(room_name)
+
+
+def history_etag(request):
+    # every page and filter of the listing is its own representation
+    marker = f'{request.user.pk}|{PlayerData.history_marker(request.user)}|{request.get_full_path()}'
+    return hashlib.md5(marker.encode('utf-8')).hexdigest()
 
 
 class GameRoomCreate(CreateAPIView):
@@ -11,6 +45,7 @@ class GameRoomCreate(CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
 
+@method_decorator([revalidate, condition(etag_func=room_etag)], name='get')
 class GameRoomDetail(RetrieveAPIView):
     queryset = GameRoom.objects.all()
     serializer_class = GameRoomSerializer
@@ -20,18 +55,174 @@ class GameRoomDetail(RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
 
+class GameRoomReplay(APIView):
+    """NDJSON stream of a finished game's moves and the states they led to, see `game.replay`
+
+    query params:
+        round: round to start from, defaults to 1 (Int)
+        move: moves of `round` to skip, the first line holds the state after them (Int)
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, room_name):
+        # the final game_data is only read when the stream gets to the end
+        room = get_object_or_404(
+            GameRoom.objects.defer('game_data'), permanent_url=room_name, status=GameRoom.StatusType.END
+        )
+        from_round = self._get_int_param('round', 1)
+        from_move = self._get_int_param('move', 0)
+        if not RoundLog.objects.filter(room=room, round=from_round).exists():
+            raise NotFound('No replay of this round was recorded.')
+
+        lines = (json.dumps(event) + '\n' for event in replay_events(room, from_round, from_move))
+        return StreamingHttpResponse(in_thread(lines), content_type='application/x-ndjson')
+
+    def _get_int_param(self, name, default):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            value = -1
+        if value < 0:
+            raise ValidationError({name: 'A valid non-negative integer is required.'})
+        return value
+
+
 class GameRoomList(ListAPIView):
-    queryset = GameRoom.objects.all().filter(status=GameRoom.StatusType.ORGANIZE)
+    """organizing rooms, newest first
+
+    query params:
+        volume: only rooms of this size (Int)
+        open_seats: `true` to only list rooms which still have a free seat
+    """
     serializer_class = LightGameRoomSerializer
+    pagination_class = RoomCursorPagination
 
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        queryset = GameRoom.objects.filter(status=GameRoom.StatusType.ORGANIZE).light()
+        params = self.request.query_params
+
+        volume = params.get('volume')
+        if volume is not None:
+            try:
+                queryset = queryset.filter(volume=int(volume))
+            except ValueError:
+                raise ValidationError({'volume': 'A valid integer is required.'})
+
+        if params.get('open_seats', '').lower() in ('1', 'true'):
+            queryset = queryset.filter(players_length__lt=F('volume'))
 
+        return queryset
+
+
+@method_decorator([revalidate, condition(etag_func=history_etag)], name='get')
 class SelfGameRoomHistoryList(ListAPIView):
     serializer_class = LightGameRoomSerializer
+    pagination_class = RoomCursorPagination
 
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
-        return GameRoom.objects.filter(playerdata__player=user)
+        return GameRoom.objects.filter(playerdata__player=user).light()
+
+
+class SelfGameRoomHistoryExport(APIView):
+    """every finished game of the user streamed as NDJSON or CSV, see `game.export`
+
+    query params:
+        output: `ndjson`, the default, or `csv`
+        since: only games created at or after this date or datetime
+        until: only games created before this date or datetime
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        # `format` is taken by the renderer negotiation of rest framework
+        output = params.get('output', export.NDJSON)
+        if output not in export.OUTPUTS:
+            raise ValidationError({'output': f'Must be one of {", ".join(export.OUTPUTS)}.'})
+
+        rows = export.history_rows(request.user, self._get_datetime_param('since'), self._get_datetime_param('until'))
+        response = StreamingHttpResponse(
+            in_thread(export.export_lines(rows, output)), content_type=export.OUTPUTS[output]
+        )
+        response['Content-Disposition'] = f'attachment; filename="history.{output}"'
+        return response
+
+    def _get_datetime_param(self, name):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                date = parse_date(value)
+                parsed = None if date is None else datetime.combine(date, time.min)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: 'A valid date or datetime is required.'})
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+
+def _get_board(request):
+    board = request.query_params.get('board', BOARDS[0])
+    if board not in BOARDS:
+        raise ValidationError({'board': f'Must be one of {", ".join(BOARDS)}.'})
+    return board
+
+
+class LeaderboardTop(APIView):
+    """best players of a board, see `game.leaderboard`
+
+    query params:
+        board: `all`, the default, or `recent`
+        limit: number of players, defaults to 10 (Int)
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        board = _get_board(request)
+        leaderboard = get_leaderboard()
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= leaderboard.top_size:
+            raise ValidationError({'limit': f'A number between 1 and {leaderboard.top_size} is required.'})
+
+        results = [
+            {'rank': rank, 'player': username, 'points': points}
+            for rank, (username, points) in enumerate(leaderboard.top(board, limit), 1)
+        ]
+        return Response({'board': board, 'results': results})
+
+
+class SelfLeaderboardRank(APIView):
+    """the user's rank and points on a board, `rank` is null before the first finished game
+
+    query params:
+        board: `all`, the default, or `recent`
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        board = _get_board(request)
+        rank, points = get_leaderboard().rank(board, request.user.username) or (None, 0)
+        return Response({'board': board, 'player': request.user.username, 'rank': rank, 'points': points})
+
+
+class SelfPlayerSummaryDetail(RetrieveAPIView):
+    serializer_class = PlayerSummarySerializer
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_object(self):
+        user = self.request.user
+        # users without a finished game have no row yet
+        return PlayerSummary.objects.filter(player=user).first() or PlayerSummary(player=user)
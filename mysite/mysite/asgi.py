@@ -16,6 +16,7 @@ django.setup()
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 import game.routing
+from game.sweeper import start_in_process_sweeper
 from .channels_middleware import JwtAuthMiddlewareStack
 
 
@@ -26,5 +27,8 @@ application = ProtocolTypeRouter({
         URLRouter(
             game.routing.websocket_urlpatterns
         )
-    )
+    ),
+    'channel': game.routing.shard_application,
 })
+
+start_in_process_sweeper()
@@ -1,26 +1,78 @@
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
 from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
-from django.db import close_old_connections
-from rest_framework_simplejwt.tokens import UntypedToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from jwt import decode as jwt_decode
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from urllib.parse import parse_qs
-from authentication.models import CustomUser
-from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
 
+# header.payload.signature, each part base64url encoded
+TOKEN_PATTERN = re.compile(r'^[\w-]+\.[\w-]+\.[\w-]+$')
+TOKEN_MAX_LENGTH = 4096
 
-@database_sync_to_async
-def get_user(validated_token):
-    try:
-        user = get_user_model().objects.get(id=validated_token["user_id"])
-        # return get_user_model().objects.get(id=toke_id)
+
+class UserCache:
+    """
+    Bounded LRU cache of resolved users, entries expire after `ttl` seconds
+
+    Only touched from the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+
+        user, expire_at = entry
+        if expire_at < time.monotonic():
+            del self._entries[user_id]
+            return None
+
+        self._entries.move_to_end(user_id)
         return user
 
-    except CustomUser.DoesNotExist:
-        return AnonymousUser()
+    def set(self, user_id, user):
+        self._entries[user_id] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+user_cache = UserCache(
+    max_size=getattr(settings, 'WEBSOCKET_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'WEBSOCKET_USER_CACHE_TTL', 60),
+)
+
+
+@database_sync_to_async
+def get_user(user_id):
+    return get_user_model().objects.filter(id=user_id, is_active=True).first()
+
+
+def get_token(scope):
+    """return the `token` query string value, or None when it can not be a jwt"""
+    tokens = parse_qs(scope.get('query_string', b'').decode('utf8')).get('token')
+    if not tokens:
+        return None
+
+    token = tokens[0]
+    if len(token) > TOKEN_MAX_LENGTH or not TOKEN_PATTERN.match(token):
+        return None
+    return token
 
 
 class JwtAuthMiddleware(BaseMiddleware):
@@ -33,40 +85,36 @@ class JwtAuthMiddleware(BaseMiddleware):
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
+        token = get_token(scope)
+        if token is None:
+            return await self.reject(receive, send)
 
-        # Close old database connections to prevent usage of timed out connections
-        close_old_connections()
+        try:
+            # validate and decode the token in a single pass
+            payload = UntypedToken(token).payload
+            user_id = payload[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            return await self.reject(receive, send)
 
-        # Get the token
-        token = parse_qs(scope["query_string"].decode("utf8"))["token"][0]
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await get_user(user_id)
+            if user is None:
+                return await self.reject(receive, send)
+            user_cache.set(user_id, user)
 
-        # Try to authenticate the user
-        try:
-            # This will automatically validate the token and raise an error if token is invalid
-            UntypedToken(token)
-        except (InvalidToken, TokenError) as e:
-            # Token is invalid
-            print(e)
-            return None
-        else:
-            #  Then token is valid, decode it
-            decoded_data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-
-            # Will return a dictionary like -
-            # {
-            #     "token_type": "access",
-            #     "exp": 1568770772,
-            #     "jti": "5c15e80d65b04c20ad34d77b6703251b",
-            #     "user_id": 6
-            # }
-
-            # Get the user using ID
-            scope["user"] = await get_user(validated_token=decoded_data)
-            # user = await (get_user_model().objects.get(id=decoded_data["user_id"]))
+        scope['user'] = user
 
         # Return the inner application directly and let it run everything else
         return await super().__call__(scope, receive, send)
 
+    @staticmethod
+    async def reject(receive, send):
+        # answer the pending handshake with a close, the client gets a 403
+        message = await receive()
+        if message['type'] == 'websocket.connect':
+            await send({'type': 'websocket.close', 'code': 4001})
+
 
 def JwtAuthMiddlewareStack(inner):
     return JwtAuthMiddleware(AuthMiddlewareStack(inner))
@@ -0,0 +1,5 @@
+"""postgresql backend borrowing its connections from a bounded per-process pool
+
+Set `'ENGINE': 'mysite.db_pool'` and tune the pool with the `POOL` key of the
+database settings, see `mysite.db_pool.pool.ConnectionPool`.
+"""
@@ -0,0 +1,38 @@
+from django.db.backends.postgresql import base
+
+from .pool import PoolTimeout, get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Opening a connection borrows one from the process' pool and closing it
+    gives it back, so the per-call `close_old_connections()` of channels costs
+    no reconnect and the number of server connections no longer follows the
+    number of threads.
+
+    `POOL` settings: `MAX_SIZE`, `TIMEOUT`, `MAX_IDLE` and `CHECK_AFTER`, see `ConnectionPool`
+    """
+
+    def get_pool(self):
+        settings_dict = self.settings_dict
+        # a wrapper of the same alias may point to another database, e.g. while creating the test database
+        key = (self.alias, settings_dict['NAME'], settings_dict['HOST'], settings_dict['PORT'], settings_dict['USER'])
+        options = {name.lower(): value for name, value in settings_dict.get('POOL', {}).items()}
+        return get_pool(key, self.alias, **options)
+
+    def get_new_connection(self, conn_params):
+        try:
+            connection = self.get_pool().acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        except PoolTimeout as e:
+            raise self.Database.OperationalError(str(e)) from e
+
+        if not hasattr(self, 'isolation_level'):
+            # the connection was opened by another thread's wrapper
+            self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # closed inside an atomic block the wrapper keeps referring to it, nobody else may get it
+                self.get_pool().release(self.connection, reuse=not self.in_atomic_block)
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import deque
+
+from mysite.metrics import Counter, Gauge, Histogram
+
+wait_seconds = Histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a pooled database connection.', ['alias'])
+timeouts = Counter(
+    'db_pool_timeouts', 'Checkouts that gave up waiting for a database connection.', ['alias'])
+connections = Gauge(
+    'db_pool_connections', 'Open pooled database connections.', ['alias', 'state'])
+
+# psycopg2.extensions.TRANSACTION_STATUS_IDLE
+TRANSACTION_STATUS_IDLE = 0
+
+
+class PoolTimeout(Exception):
+    """no connection became free within the pool's timeout"""
+
+
+class ConnectionPool:
+    """
+    At most `max_size` connections are open, checkouts wait up to `timeout`
+    seconds for one to be returned. The most recently returned connection is
+    handed out first so the others can reach `max_idle` and be closed.
+
+    :parms
+        alias: database alias, used as metrics label (Str)
+        max_size: hard limit of open connections (Int)
+        timeout: seconds a checkout waits for a free connection (Float)
+        max_idle: seconds after which an unused connection is closed (Float)
+        check_after: idle seconds after which a connection is pinged before reuse (Float)
+    """
+
+    def __init__(self, alias, max_size=10, timeout=10, max_idle=300, check_after=30):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+
+        self._idle = deque()  # (connection, returned_at)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._idle_gauge = connections.labels(alias, 'idle')
+        self._used_gauge = connections.labels(alias, 'in_use')
+        self._wait_histogram = wait_seconds.labels(alias)
+
+    def acquire(self, connect):
+        """
+        :parms
+            connect: opens a new connection when the pool may grow (Callable)
+
+        :raises
+            PoolTimeout: `max_size` connections stayed in use for `timeout` seconds
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            connection, returned_at = self._checkout(deadline)
+            if connection is None:
+                try:
+                    connection = connect()
+                except BaseException:
+                    self._forget()
+                    raise
+                break
+            if self._is_usable(connection, returned_at):
+                break
+            self._discard(connection)
+
+        self._wait_histogram.observe(time.monotonic() - started)
+        self._used_gauge.inc()
+        return connection
+
+    def release(self, connection, reuse=True):
+        """give `connection` back, it is rolled back first, or closed when broken or `reuse` is False"""
+        self._used_gauge.dec()
+        if not reuse or not self._reset(connection):
+            self._discard(connection)
+            return
+
+        with self._cond:
+            self._idle.append((connection, time.monotonic()))
+            self._idle_gauge.inc()
+            expired = self._pop_expired()
+            self._cond.notify()
+        for connection in expired:
+            self._discard(connection)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+            self._idle_gauge.dec(len(idle))
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def _checkout(self, deadline):
+        """an idle `(connection, returned_at)`, or `(None, None)` when a new one may be opened"""
+        with self._cond:
+            while True:
+                if self._idle:
+                    self._idle_gauge.dec()
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timeouts.labels(self.alias).inc()
+                    raise PoolTimeout(f'no free connection for {self.alias!r} within {self.timeout}s')
+                self._cond.wait(remaining)
+
+    def _pop_expired(self):
+        expired = []
+        limit = time.monotonic() - self.max_idle
+        while self._idle and self._idle[0][1] < limit:
+            expired.append(self._idle.popleft()[0])
+            self._idle_gauge.dec()
+        return expired
+
+    def _is_usable(self, connection, returned_at):
+        if connection.closed:
+            return False
+        idle_for = time.monotonic() - returned_at
+        if idle_for > self.max_idle:
+            return False
+        if idle_for > self.check_after:
+            # the server or a proxy may have dropped it meanwhile
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            except Exception:
+                return False
+        return True
+
+    def _reset(self, connection):
+        """leave no transaction open on a returned connection, False if it can not be reused"""
+        if connection.closed:
+            return False
+        try:
+            if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            return connection.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self._forget()
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = None
+
+
+def get_pool(key, alias, **options) -> ConnectionPool:
+    """the process' pool of `key`, created on first use
+
+    pools are not shared with forked children, they start with their own
+    """
+    global _pools_pid
+    pool = _pools.get(key)
+    if pool is not None and _pools_pid == os.getpid():
+        return pool
+
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(alias, **options)
+    return pool
@@ -91,17 +91,137 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Application data (not the channel layer) lives in its own redis database
+REDIS_URL = 'redis://redis:6379/1'
+
+# Multi-worker mode: rooms are hashed onto the live `manage.py runshard` workers, see `game.sharding`
+GAME_SHARDING = {
+    'ENABLED': False,
+    'REGISTRY': 'game.sharding.RedisWorkerRegistry',
+    'HEARTBEAT_INTERVAL': 5,  # seconds
+    'WORKER_TIMEOUT': 15,  # seconds without heartbeat before a worker's rooms move on
+}
+
+# Live game state, checkpointed to `GameRoom.game_data` at round boundaries, see `game.state_store`
+GAME_STATE_STORE = {
+    'BACKEND': 'game.state_store.RedisStateStore',
+    'OPTIONS': {
+        'ttl': 24 * 60 * 60,  # seconds
+    },
+}
+
+# Recent room updates replayed to reconnecting clients, see `game.resume`
+GAME_RESUME_BUFFER = {
+    'BACKEND': 'game.resume.RedisResumeBuffer',
+    'OPTIONS': {
+        'size': 32,  # updates kept per room
+        'ttl': 24 * 60 * 60,  # seconds
+    },
+}
+
+# Standings of finished games, see `game.leaderboard`
+GAME_LEADERBOARD = {
+    'BACKEND': 'game.leaderboard.RedisLeaderboard',
+    'OPTIONS': {
+        'window_days': 7,  # days summed up by the recent board
+        'top_size': 100,  # entries of a cached top
+        'cache_ttl': 10,  # seconds
+    },
+}
+
+# Batches of queued players put into new rooms, see `game.matchmaking`
+MATCHMAKING = {
+    'INTERVAL': 1,  # seconds between two batches
+    'BATCH_SIZE': 200,  # most rooms created by one batch
+}
+
+# Spectators share one coalesced feed per room and process, see `game.spectators`
+SPECTATORS = {
+    'MAX_UPDATES_PER_SECOND': 2,  # frames sent per room and second at most
+}
+
+# Deadlines of the players' turns, see `game.turn_timers`
+TURN_TIMER = {
+    'ENABLED': True,
+    'TIMEOUT': 60,  # seconds for a move before the first hand card is folded
+    'TICK': 1,  # seconds, the resolution of the deadlines
+    'SLOTS': 64,  # slots per wheel level
+    'LEVELS': 3,  # deadlines further than TICK * SLOTS ** LEVELS seconds ahead are placed again every lap
+}
+
+# Expiry of abandoned rooms and archive of finished games, see `game.sweeper`
+ROOM_SWEEPER = {
+    'IN_PROCESS': False,  # sweep from a thread of every ASGI process instead of `manage.py sweeprooms`
+    'INTERVAL': 60,  # seconds between two in-process sweeps
+    'ORGANIZE_TTL': 60 * 60,  # seconds an untouched organizing room is kept
+    'PRESENCE_INTERVAL': 5 * 60,  # seconds between two touches of the rooms with connected sockets
+    'PLAYING_TTL': 24 * 60 * 60,  # seconds a game without live state is kept playing
+    'ARCHIVE_AFTER': 10 * 60,  # seconds before a finished game is archived
+    'BATCH_SIZE': 500,
+}
+
+# Users resolved from websocket jwt are cached per process, see `mysite.channels_middleware`
+WEBSOCKET_USER_CACHE_SIZE = 10000
+WEBSOCKET_USER_CACHE_TTL = 60  # seconds
+
+# Token buckets of the events game sockets send, (tokens per second, burst), see `game.ratelimit`
+WEBSOCKET_RATE_LIMITS = {
+    'SOCKET': {
+        # a player moves once per turn, the others move in between, so even a bot folding
+        # at once stays well below this, illegal plays retried from the ui included
+        'play_card': (10, 20),
+        'volume_change': (1, 3),
+        'status_change': (0.5, 3),
+        'kick_player': (0.5, 3),
+        'create_new_room': (0.1, 1),
+        'default': (5, 10),
+    },
+    # shared by every socket of a user in the process
+    'USER': {
+        'play_card': (20, 40),
+        'volume_change': (2, 5),
+        'status_change': (1, 5),
+        'kick_player': (1, 5),
+        'create_new_room': (0.2, 2),
+        'default': (10, 20),
+    },
+    'MAX_VIOLATIONS': 20,  # rate limited events within the window before the socket is closed
+    'VIOLATION_WINDOW': 10,  # seconds
+}
+
+# Sampled span tracing of room events and broadcasts, see `mysite.tracing`
+TRACING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,  # share of root spans recorded
+    'PATH': os.path.join(BASE_DIR, 'traces', 'trace-{pid}.json'),
+}
+
+# Addresses allowed to scrape `/metrics`, '*' allows everyone, see `mysite.metrics`
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+# Proxies (addresses or networks) whose `X-Real-IP` names the scraper, as nginx sets it
+# e.g. the docker network nginx connects from, '172.16.0.0/12'
+METRICS_TRUSTED_PROXIES = []
+
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # postgresql with a bounded per-process connection pool, see `mysite.db_pool`
+        'ENGINE': 'mysite.db_pool',
         'NAME': 'postgres',
         'USER': 'postgres',
         'PASSWORD': str(os.environ['POSTGRES_PASSWORD']),
         'HOST': 'db',
         'PORT': 5432,
+        # closing a connection returns it to the pool, keep the default of closing after every call
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': 20,  # connections per process, whatever the number of threads
+            'TIMEOUT': 10,  # seconds to wait for a free connection
+            'MAX_IDLE': 300,  # seconds before an unused connection is closed
+            'CHECK_AFTER': 30,  # idle seconds before a connection is pinged on checkout
+        },
     }
 }
 
@@ -163,6 +283,14 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = "authentication.CustomUser"
 
+# Passwords are checked on a bounded pool of their own, see `authentication.hashing`
+AUTHENTICATION_BACKENDS = ['authentication.hashing.PooledModelBackend']
+
+PASSWORD_HASHING_POOL = {
+    'WORKERS': 2,  # threads hashing at once
+    'MAX_QUEUE': 8,  # hashes waiting for a thread before requests are refused with a 429
+}
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=14),
@@ -177,3 +305,11 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
+
+# In-process filter in front of the refresh token blacklist, see `authentication.blacklist`
+TOKEN_BLACKLIST_FILTER = {
+    'CAPACITY': 100000,  # blacklisted tokens held before the filter is rebuilt larger
+    'ERROR_RATE': 0.01,  # share of tokens not blacklisted still checked against the database
+    'REFRESH_INTERVAL': 5,  # seconds between two reads of the newly blacklisted tokens
+    'REBUILD_INTERVAL': 60 * 60,  # seconds between two full rebuilds, dropping pruned tokens
+}
@@ -5,3 +5,6 @@ from .base import *
 DEBUG = False
 
 ALLOWED_HOSTS = ['saboteur.ooad.tk', 'localhost']
+
+# nginx reaches daphne over the docker networks, its `X-Real-IP` names the scraper
+METRICS_TRUSTED_PROXIES = ['172.16.0.0/12']
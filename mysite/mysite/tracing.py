@@ -0,0 +1,109 @@
+"""opt-in sampled span tracing, exported in the chrome trace event format
+
+A root span (`trace`) decides whether the work below it is sampled, nested
+`span`s only record while a sampled root is open and cost a context variable
+read otherwise. Every finished trace is appended to `TRACING['PATH']` as
+complete ("X") events, one track per trace, which chrome://tracing and
+https://ui.perfetto.dev open as is (the closing `]` is optional in the
+format, so the file can keep growing).
+"""
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_NOOP = nullcontext()
+_current = ContextVar('trace', default=None)
+_trace_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'args', 'start')
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        event = {
+            'name': self.name, 'ph': 'X', 'pid': os.getpid(), 'tid': self.trace.id,
+            'ts': (self.start - self.trace.origin) / 1000 + self.trace.epoch_us,
+            'dur': (end - self.start) / 1000,
+        }
+        if self.args:
+            event['args'] = self.args
+        if exc_type is not None:
+            event.setdefault('args', {})['error'] = exc_type.__name__
+        self.trace.events.append(event)
+        return False
+
+
+class Trace(Span):
+    """root span, owns the events of everything traced below it"""
+    __slots__ = ('id', 'events', 'origin', 'epoch_us', '_token')
+
+    def __init__(self, name, args):
+        super().__init__(self, name, args)
+        self.id = next(_trace_ids)
+        self.events = []
+        # perf_counter for durations, wall clock so that traces of different processes line up
+        self.origin = time.perf_counter_ns()
+        self.epoch_us = time.time_ns() / 1000
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        _current.reset(self._token)
+        exporter.export(self.events)
+        return False
+
+
+class TraceFileExporter:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def export(self, events):
+        path = settings.TRACING['PATH'].format(pid=os.getpid())
+        lines = ',\n'.join(json.dumps(event, ensure_ascii=False) for event in events)
+        with self._lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(('[\n' if f.tell() == 0 else ',\n') + lines)
+
+
+exporter = TraceFileExporter()
+
+
+def trace(name: str, **args):
+    """start a sampled trace, or a child span when a trace is already open"""
+    parent = _current.get()
+    if parent is not None:
+        return Span(parent, name, args)
+
+    config = settings.TRACING
+    if not config['ENABLED'] or random.random() >= config['SAMPLE_RATE']:
+        return _NOOP
+    return Trace(name, args)
+
+
+def span(name: str, **args):
+    """time the block as a child of the open trace, a no-op outside of one"""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(parent, name, args)
@@ -19,10 +19,13 @@ from django.urls import path
 from django.urls import re_path
 from django.views.generic import TemplateView
 
+from mysite.metrics import metrics_view
+
 
 urlpatterns = [
     path('api/auth/', include('authentication.urls')),
     path('api/game/', include('game.urls')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     re_path(r'^.*', TemplateView.as_view(template_name='index.html')),
 ]
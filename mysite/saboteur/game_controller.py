@@ -12,6 +12,7 @@ from random import shuffle
 from .player import Player
 from .card import *
 from .util import *
+from .tracing import span
 
 BASE_URL = Path(__file__).resolve().parent
 
@@ -110,7 +111,8 @@ class GameController():
             now_play = self.player_list[self.turn % self.num_player]
             self.now_play = now_play.id
             card, pos, action_type = now_play.play_card(card_id, position, rotate, act_type)
-            legal, illegal_msg = card.check_legality(self, now_play, pos, action_type)
+            with span('check_legality'):
+                legal, illegal_msg = card.check_legality(self, now_play, pos, action_type)
             if not legal:
                 # return illegal card to player
                 self.deal_card([now_play], card)
@@ -119,41 +121,43 @@ class GameController():
                 self.return_msg[self.turn % self.num_player] = personalize_msg
                 return
 
-            return_msg = card.activate(self, pos, action_type)
+            with span('activate'):
+                return_msg = card.activate(self, pos, action_type)
 
             flag = 0
             for player in self.player_list:
                 if len(player.hand_cards) == 0:
                     flag += 1
 
-            if pos == 7 or pos == 17 or \
-                    pos == 25 or pos == 35 or pos == 43:
-
-                # show end card
-                if pos == 7 or pos == 25 or pos == 43:
-                    pos_ = [pos + 1]
-                elif pos == 17 or pos == 35:
-                    pos_ = [pos - 9, pos + 9]
-                for p in pos_:
-                    pos_row = p // 9
-                    pos_col = p % 9
-                    end_card = self.board[pos_row][pos_col]
+            with span('connectivity'):
+                if pos == 7 or pos == 17 or \
+                        pos == 25 or pos == 35 or pos == 43:
+
+                    # show end card
+                    if pos == 7 or pos == 25 or pos == 43:
+                        pos_ = [pos + 1]
+                    elif pos == 17 or pos == 35:
+                        pos_ = [pos - 9, pos + 9]
+                    for p in pos_:
+                        pos_row = p // 9
+                        pos_col = p % 9
+                        end_card = self.board[pos_row][pos_col]
+                        went = [[False for _ in range(9)] for _ in range(5)]
+                        if end_card.card_no > 70 and \
+                                self.connect_to_start(end_card, pos_row, pos_col, went):
+                            self.board[pos_row][pos_col].card_no -= 70
+
+                    gold_row = self.gold_pos // 9
+                    gold_col = self.gold_pos % 9
                     went = [[False for _ in range(9)] for _ in range(5)]
-                    if end_card.card_no > 70 and \
-                            self.connect_to_start(end_card, pos_row, pos_col, went):
-                        self.board[pos_row][pos_col].card_no -= 70
-
-                gold_row = self.gold_pos // 9
-                gold_col = self.gold_pos % 9
-                went = [[False for _ in range(9)] for _ in range(5)]
-                if self.connect_to_start(self.board[gold_row][gold_col], gold_row, gold_col, went):  # good dwarf win
-                    self.winner_list = [winner for winner in self.player_list if winner.role]
-                    self.winner = now_play
-                    flag -= 1
-
-                    self.game_state = GameState.game_point
-                    return_msg = {"msg_type": "INFO", "msg": f"第 {self.round} 回合 好矮人獲勝"}
-                    self.return_msg = [return_msg.copy() for _ in range(self.num_player)]
+                    if self.connect_to_start(self.board[gold_row][gold_col], gold_row, gold_col, went):  # good dwarf win
+                        self.winner_list = [winner for winner in self.player_list if winner.role]
+                        self.winner = now_play
+                        flag -= 1
+
+                        self.game_state = GameState.game_point
+                        return_msg = {"msg_type": "INFO", "msg": f"第 {self.round} 回合 好矮人獲勝"}
+                        self.return_msg = [return_msg.copy() for _ in range(self.num_player)]
 
             if len(self.card_pool) > 0:
                 self.deal_card([now_play])
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# tracing.py
+"""hook letting the web server time the phases of a move
+
+the engine stays free of any tracing dependency, `span` is a no-op until
+the host application installs its tracer with `set_tracer`
+"""
+from contextlib import nullcontext
+
+_NOOP = nullcontext()
+_tracer = None
+
+
+def set_tracer(tracer):
+    """
+    :parms
+        tracer: callable(name) returning a context manager, None to disable (Callable)
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def span(name: str):
+    return _NOOP if _tracer is None else _tracer(name)